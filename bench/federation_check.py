@@ -0,0 +1,152 @@
+#__________________________________________IMPORTS
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from suite import REPO, HEADERS, Component, wait_until_up
+
+#__________________________________________Hub federation check: convergence and failover of three local hubs
+# Starts three hubs that replicate each other (HUB_PEERS) and a set of stub
+# channels, then checks step by step that
+#   - channels registered on different hubs end up in every hub's directory,
+#   - conflicting registrations made on two hubs at once settle on one record,
+#   - heartbeats sent to one hub show up in every hub's heartbeat_within filter,
+#   - the health checks are split between the hubs, and when one hub stops the
+#     others take over its channels (the stub channels are stopped and every
+#     channel has to be marked inactive on the remaining hubs),
+#   - a restarted hub catches up and gets its share of the channels back.
+# Prints how long each step took and exits with status 1 if one fails.
+#
+#   python bench/federation_check.py --stubs 30
+
+
+def call(url, method='GET', body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers=dict(HEADERS, **{'Content-Type': 'application/json'}))
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def wait_for(description, condition, timeout):  # -> seconds until condition() held
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            if condition():
+                elapsed = time.monotonic() - start
+                print('ok    {:<60} {:6.1f} s'.format(description, elapsed), flush=True)
+                return elapsed
+        except OSError:  # a hub that is starting or stopping
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('{} (not within {} s)'.format(description, timeout))
+
+
+def directory(hub_url):  # endpoint -> (name, type of service, active)
+    return {c['endpoint']: (c['name'], c['type_of_service'], c['active']) for c in call(hub_url + '/channels')['channels']}
+
+
+def start_hub(urls, i, workdir):
+    peers = ','.join(url for url in urls if url != urls[i])
+    port = int(urls[i].rsplit(':', 1)[1])
+    return Component('hub{}'.format(i + 1),
+                     [sys.executable, '-c', "import hub; hub.health_scheduler.start(); hub.federation.start(); "
+                                            "hub.app.run(port={}, threaded=True)".format(port)],
+                     workdir, {'HUB_URL': urls[i], 'HUB_PEERS': peers,
+                               'HUB_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'hub{}.sqlite'.format(i + 1))})
+
+
+def run_check(args):
+    urls = ['http://127.0.0.1:{}'.format(args.hub_port + i) for i in range(3)]
+    records = [{'name': 'Stub Channel {}'.format(port), 'endpoint': 'http://127.0.0.1:{}'.format(port),
+                'authkey': '1234567890', 'type_of_service': 'aiweb24:chat'}
+               for port in range(args.stub_port, args.stub_port + args.stubs)]
+    endpoints = {record['endpoint'] for record in records}
+    with tempfile.TemporaryDirectory() as workdir:
+        stubs = Component('stubs', [sys.executable, os.path.join(REPO, 'bench', 'stub_channel.py'),
+                                    '--first-port', str(args.stub_port), '--count', str(args.stubs)], workdir)
+        hubs = [start_hub(urls, i, workdir) for i in range(3)]
+        try:
+            for url in urls:
+                wait_until_up(url + '/channels')
+            wait_until_up('http://127.0.0.1:{}/health'.format(args.stub_port))
+
+            # each hub gets a third of the registrations
+            for i, url in enumerate(urls):
+                call(url + '/channels/batch', 'POST', records[i::3])
+            wait_for('all channels in every directory',
+                     lambda: all(set(directory(url)) == endpoints for url in urls), args.timeout)
+
+            # two hubs get a different record for the same channel at the same time
+            conflicting = [dict(records[0], type_of_service='aiweb24:chat-' + url[-4:]) for url in urls[1:]]
+            threads = [threading.Thread(target=call, args=(url + '/channels', 'POST', record))
+                       for url, record in zip(urls[1:], conflicting)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wait_for('conflicting registrations settled on one record',
+                     lambda: len({directory(url)[records[0]['endpoint']][1] for url in urls}) == 1
+                             and directory(urls[0])[records[0]['endpoint']][1] != 'aiweb24:chat', args.timeout)
+
+            # every channel sends its heartbeat to hub 1 only
+            time.sleep(3)
+            call(urls[0] + '/heartbeat', 'POST', [{'endpoint': r['endpoint'], 'authkey': r['authkey']} for r in records])
+            wait_for('heartbeats sent to hub 1 seen by every hub',
+                     lambda: all({c['endpoint'] for c in call(url + '/channels?heartbeat_within=2&limit=1000')['channels']}
+                                 == endpoints for url in urls), args.timeout)
+
+            statuses = [call(url + '/federation') for url in urls]
+            owned = [status['owned'] for status in statuses]
+            print('      health checks per hub: {}'.format(owned))
+            if sum(owned) != len(endpoints):
+                raise RuntimeError('{} channels health-checked, expected {}'.format(sum(owned), len(endpoints)))
+
+            # hub 2 stops: hubs 1 and 3 split its channels between them
+            hubs[1].stop()
+            survivors = [urls[0], urls[2]]
+            wait_for('hubs 1 and 3 took over the channels of hub 2',
+                     lambda: all(call(url + '/federation')['members'] == survivors for url in survivors)
+                             and sum(call(url + '/federation')['owned'] for url in survivors) == len(endpoints),
+                     args.timeout)
+
+            # every channel goes down, the remaining hubs have to notice all of them
+            stubs.stop()
+            for url in survivors:
+                urllib.request.urlopen(url + '/health', timeout=30).read()  # sweeps now instead of within a minute
+            wait_for('all channels inactive on hubs 1 and 3',
+                     lambda: all(not active for url in survivors for _, _, active in directory(url).values()),
+                     args.timeout)
+
+            # hub 2 comes back with its database: it catches up and takes its share again
+            hubs[1] = start_hub(urls, 1, workdir)
+            wait_until_up(urls[1] + '/channels')
+            wait_for('hub 2 caught up after its restart',
+                     lambda: directory(urls[1]) == directory(urls[0]) == directory(urls[2]), args.timeout)
+            wait_for('hub 2 is back in the health check ring',
+                     lambda: all(call(url + '/federation')['members'] == urls for url in urls)
+                             and sum(call(url + '/federation')['owned'] for url in urls) == len(endpoints),
+                     args.timeout)
+        except RuntimeError as e:
+            print('FAIL  {}'.format(e))
+            return 1
+        finally:
+            for component in hubs + [stubs]:
+                component.stop()
+    print('all checks passed')
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stubs', type=int, default=30, help='stub channels registered with the hubs')
+    parser.add_argument('--hub-port', type=int, default=5661, help='first of three hub ports')
+    parser.add_argument('--stub-port', type=int, default=6100)
+    parser.add_argument('--timeout', type=float, default=60, help='seconds each step may take')
+    sys.exit(run_check(parser.parse_args()))
@@ -0,0 +1,121 @@
+#__________________________________________IMPORTS
+import asyncio
+import json
+import time
+import urllib.parse
+
+#__________________________________________Minimal asyncio HTTP/1.1 client with keep-alive
+# Small enough to open thousands of concurrent connections from one process,
+# which is what the load tests need; it is not a general purpose client.
+class HttpConnection(object):
+    def __init__(self, url, headers=None):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.netloc = parts.netloc
+        self.headers = headers or {}
+        self.reader = self.writer = None
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        # returns (status, headers, body); reconnects once if the server closed the connection
+        for attempt in range(2):
+            if self.writer is None:
+                await self._connect()
+            try:
+                return await self._request(method, path, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+
+    async def _request(self, method, path, body, headers):
+        lines = ['{} {} HTTP/1.1'.format(method, path), 'Host: {}'.format(self.netloc)]
+        all_headers = dict(self.headers, **(headers or {}))
+        if body is not None:
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode('utf-8')
+                all_headers.setdefault('Content-Type', 'application/json')
+            all_headers['Content-Length'] = str(len(body))
+        lines += ['{}: {}'.format(k, v) for k, v in all_headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length']))
+        elif status in (204, 304):
+            data = b''
+        else:  # no length: the body runs until the server closes the connection
+            data = await self.reader.read()
+            self.close()
+        if response_headers.get('connection', '').lower() == 'close' or status_line.startswith(b'HTTP/1.0'):
+            self.close()
+        return status, response_headers, data
+
+
+#__________________________________________Statistics
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+
+def summarize(latencies, errors, seconds):
+    # latencies in seconds -> throughput and percentiles in milliseconds
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {'requests': len(latencies),
+            'errors': errors,
+            'requests_per_second': round(len(latencies) / seconds, 1) if seconds else None,
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p90_ms': ms(percentile(latencies, 90)),
+            'p99_ms': ms(percentile(latencies, 99)),
+            'max_ms': ms(max(latencies) if latencies else None)}
+
+async def run_clients(url, concurrency, duration, make_request, headers=None, ramp_up=0):
+    # `concurrency` connections each issue requests back to back for `duration` seconds;
+    # make_request(n) returns (method, path, body) for the n-th request of a connection
+    latencies, errors = [], [0]
+    measure_from = time.monotonic() + ramp_up  # requests during the ramp-up are not counted
+    stop_at = measure_from + duration
+
+    async def client(index):
+        if ramp_up:
+            await asyncio.sleep(ramp_up * index / concurrency)
+        connection = HttpConnection(url, headers)
+        n = 0
+        while time.monotonic() < stop_at:
+            method, path, body = make_request(n)
+            n += 1
+            start = time.monotonic()
+            try:
+                status, _, _ = await connection.request(method, path, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errors[0] += 1
+                connection.close()
+                await asyncio.sleep(0.1)
+                continue
+            if start < measure_from:
+                continue
+            if status >= 500:
+                errors[0] += 1
+            else:
+                latencies.append(time.monotonic() - start)
+        connection.close()
+
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return summarize(latencies, errors[0], duration)
@@ -0,0 +1,95 @@
+#__________________________________________IMPORTS
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import moderation
+from feedback import FeedbackEngine
+from message_store import RetentionPolicy, create_store
+
+#__________________________________________Microbenchmarks for the hot paths of a channel
+# Times the pieces a POST / goes through (profanity check, off-topic model,
+# feedback matching, message store) in isolation, so a regression found by
+# bench/suite.py can be pinned to one of them.
+#
+#   python bench/micro.py --output micro.json
+
+ON_TOPIC = "What do you think about Picasso's influence on modern art?"
+OFF_TOPIC = "Let's talk about cooking recipes."
+
+
+def message(i):
+    return {'content': ON_TOPIC, 'sender': 'bench', 'timestamp': '2025-01-01T00:00:00', 'extra': None, 'n': i}
+
+
+def timeit(function, min_time, unit=1):
+    # calls function() until min_time has passed; returns microseconds per unit of work
+    function()  # warm-up: lazy imports, model loading, caches
+    calls, start = 0, time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return {'calls': calls, 'us_per_op': round(elapsed / calls / unit * 1e6, 2)}
+
+
+def bench_moderation(min_time, batch_size):
+    profanity = moderation.get_profanity()
+    batch = [ON_TOPIC, OFF_TOPIC] * (batch_size // 2)
+    return {
+        'profanity_check': timeit(lambda: profanity.contains_profanity(ON_TOPIC), min_time),
+        'is_off_topic': timeit(lambda: moderation.is_off_topic(ON_TOPIC), min_time),
+        'off_topic_many/{}'.format(len(batch)): timeit(lambda: moderation.off_topic_many(batch), min_time, len(batch)),
+        'moderate_many/1': timeit(lambda: moderation.moderate_many([ON_TOPIC]), min_time),
+        'moderate_many/{}'.format(len(batch)): timeit(lambda: moderation.moderate_many(batch), min_time, len(batch)),
+    }
+
+
+def bench_feedback(min_time):
+    engine = FeedbackEngine(os.path.join(REPO, 'feedback_topics.json'), every=3)
+    return {
+        'feedback_for (due)': timeit(lambda: engine.feedback_for(ON_TOPIC, 2), min_time),
+        'feedback_for (not due)': timeit(lambda: engine.feedback_for(ON_TOPIC, 3), min_time),
+    }
+
+
+def bench_store(kind, min_time, path, **options):
+    store = create_store(kind, path, RetentionPolicy(), **options)
+    counter = iter(range(10 ** 9))
+    results = {
+        'append': timeit(lambda: store.append(message(next(counter))), min_time),
+        'append_many/10': timeit(lambda: store.append_many([message(next(counter)) for _ in range(10)]), min_time, 10),
+        'recent': timeit(store.recent, min_time),
+        'since (caught up)': timeit(lambda: store.since(store.state()[0]), min_time),
+        'since (limit 10)': timeit(lambda: store.since(0, 10), min_time),
+        'state': timeit(store.state, min_time),
+    }
+    store.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds spent on each benchmark')
+    parser.add_argument('--batch-size', type=int, default=32, help='messages per batched moderation call')
+    parser.add_argument('--output', help='also save the results as JSON')
+    args = parser.parse_args()
+    results = {'moderation': bench_moderation(args.min_time, args.batch_size),
+               'feedback': bench_feedback(args.min_time)}
+    with tempfile.TemporaryDirectory() as workdir:
+        results['store jsonl'] = bench_store('jsonl', args.min_time, os.path.join(workdir, 'fsync.jsonl'))
+        results['store jsonl (no fsync)'] = bench_store('jsonl', args.min_time, os.path.join(workdir, 'nofsync.jsonl'), fsync=False)
+        results['store sqlite'] = bench_store('sqlite', args.min_time, os.path.join(workdir, 'messages.sqlite'))
+    for group, benchmarks in results.items():
+        print(group)
+        for name, result in benchmarks.items():
+            print('    {:<28} {:>12.2f} us/op  ({} calls)'.format(name, result['us_per_op'], result['calls']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
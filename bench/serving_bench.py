@@ -0,0 +1,91 @@
+#__________________________________________IMPORTS
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from httpload import run_clients
+
+#__________________________________________Serving benchmark: WSGI (threaded) vs ASGI (event loop) channel
+# Starts channel.py once per serving mode and drives it with N concurrent
+# keep-alive clients. Each client polls GET /?since=<id> and every
+# `--post-every`-th request posts a message. Reports requests/s and latency
+# percentiles per mode and concurrency level.
+#
+#   python bench/serving_bench.py --concurrency 100 1000 10000 --duration 20
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEADERS = {"Authorization": "authkey 1234567890"}
+
+# all posts come from one sender and address, so the rate limits are off (the concurrency cap stays)
+NO_RATE_LIMITS = "import channel; channel.default_channel.rate_limiter = None; "
+SERVERS = {
+    'wsgi': NO_RATE_LIMITS + "channel.app.run(port={port}, threaded=True)",
+    'asgi': NO_RATE_LIMITS + "import uvicorn; uvicorn.run('channel_asgi:app', port={port}, log_level='warning', backlog=16384)",
+}
+
+
+def start_server(mode, port, workdir):
+    env = dict(os.environ, PYTHONPATH=REPO)
+    process = subprocess.Popen([sys.executable, '-c', SERVERS[mode].format(port=port)], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen('http://127.0.0.1:{}/health'.format(port), timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('{} server did not start'.format(mode))
+
+
+def make_request_factory(post_every):
+    def make_request(n):
+        if post_every and n % post_every == post_every - 1:
+            return 'POST', '/', {'content': "Let's talk about Renaissance art.", 'sender': 'bench', 'timestamp': str(time.time())}
+        return 'GET', '/?since=0&limit=10', None
+    return make_request
+
+
+def main(args):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))  # 10,000 connections need file descriptors
+    report = {}
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as workdir:
+            process = start_server(mode, args.port, workdir)
+            try:
+                report[mode] = {}
+                for concurrency in args.concurrency:
+                    result = asyncio.run(run_clients('http://127.0.0.1:{}'.format(args.port), concurrency,
+                                                     args.duration, make_request_factory(args.post_every),
+                                                     headers=HEADERS, ramp_up=args.ramp_up))
+                    report[mode][str(concurrency)] = result
+                    print(mode, concurrency, json.dumps(result), flush=True)
+            finally:
+                process.terminate()
+                process.wait()
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[100, 1000, 10000])
+    parser.add_argument('--duration', type=float, default=20, help='seconds measured per concurrency level')
+    parser.add_argument('--ramp-up', type=float, default=2, help='seconds over which connections are opened')
+    parser.add_argument('--post-every', type=int, default=20, help='every n-th request is a POST, 0 for none')
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+#__________________________________________IMPORTS
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+#__________________________________________Startup benchmark for channel.py
+# Measures, in a fresh interpreter per run, how long `import channel` takes,
+# how long the first POST takes and the peak memory of the process, for:
+#   eager-train     models loaded and trained at import (the old behaviour)
+#   eager-artifact  models loaded at import from the trained artifact
+#   lazy-artifact   models loaded from the artifact on the first message
+#
+#   python bench/startup_bench.py --runs 5
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, resource, sys, time
+t0 = time.perf_counter()
+import channel
+t1 = time.perf_counter()
+client = channel.app.test_client()
+response = client.post('/', json={'content': "Let's talk about Renaissance art.",
+                                  'sender': 'bench', 'timestamp': '0'})
+t2 = time.perf_counter()
+assert response.status_code == 200, response.data
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'first_request_ms': (t2 - t1) * 1000,
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+SCENARIOS = {
+    'eager-train': {'preload': True, 'artifact': False},
+    'eager-artifact': {'preload': True, 'artifact': True},
+    'lazy-artifact': {'preload': False, 'artifact': True},
+}
+
+
+def run_once(preload, artifact, model_file):
+    if not artifact and os.path.exists(model_file):
+        os.rename(model_file, model_file + '.bench')
+    try:
+        env = dict(os.environ, PYTHONPATH=REPO)
+        env.pop('CHANNEL_PRELOAD_MODELS', None)
+        if preload:
+            env['CHANNEL_PRELOAD_MODELS'] = '1'
+        with tempfile.TemporaryDirectory() as workdir:  # keeps the message store out of the repo
+            output = subprocess.run([sys.executable, '-c', PROBE], cwd=workdir, env=env,
+                                    check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        if os.path.exists(model_file + '.bench'):
+            os.rename(model_file + '.bench', model_file)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(args):
+    sys.path.insert(0, REPO)
+    import moderation
+    moderation.save_model(moderation.train_model())  # same as `flask --app channel.py train_model`
+    report = {}
+    for name, scenario in SCENARIOS.items():
+        runs = [run_once(scenario['preload'], scenario['artifact'], moderation.MODEL_FILE)
+                for _ in range(args.runs)]
+        report[name] = {key: round(median([run[key] for run in runs]), 1) for key in runs[0]}
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    main(parser.parse_args())
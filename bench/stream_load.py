@@ -0,0 +1,132 @@
+#__________________________________________IMPORTS
+import argparse
+import asyncio
+import json
+import time
+import urllib.parse
+
+#__________________________________________Load test for the channel push path (/stream and ?wait=)
+# Opens many concurrent subscribers against one channel process, posts a few
+# messages and reports how many subscribers stayed connected and how long
+# delivery took. Example:
+#
+#   python bench/stream_load.py --url http://localhost:5001 --subscribers 500 --mode sse
+
+HEADERS = {"Authorization": "authkey 1234567890"}
+
+
+async def open_request(url, path):
+    parts = urllib.parse.urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    lines = ['GET {} HTTP/1.1'.format(path), 'Host: {}'.format(parts.netloc)]
+    lines += ['{}: {}'.format(k, v) for k, v in HEADERS.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    await writer.drain()
+    status = await reader.readline()
+    while (await reader.readline()) not in (b'\r\n', b''):  # skip response headers
+        pass
+    return reader, writer, int(status.split()[1])
+
+
+async def sse_subscriber(url, since, expected, received, ready):
+    reader, writer, status = await open_request(url, '/stream?since={}'.format(since))
+    ready.append(status)
+    try:
+        while len(received) < expected:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b'data: '):
+                message = json.loads(line[6:])
+                received.append(time.time() - float(message['extra']['sent_at']))
+    finally:
+        writer.close()
+
+
+async def longpoll_subscriber(url, since, expected, received, ready):
+    first = True
+    while len(received) < expected:
+        # response headers only arrive once the wait ends, so count the first answer
+        reader, writer, status = await open_request(url, '/?since={}&wait=30'.format(since))
+        if first:
+            ready.append(status)
+            first = False
+        body = await reader.read()  # the dev server closes the connection after the response
+        writer.close()
+        start = body.find(b'[')
+        for message in json.loads(body[start:]) if start >= 0 else []:
+            received.append(time.time() - float(message['extra']['sent_at']))
+            since = message['id']
+
+
+async def post_message(url, n):
+    body = json.dumps({'content': "Let's talk about Renaissance art.", 'sender': 'loadtest',
+                       'timestamp': str(n), 'extra': {'sent_at': time.time()}})
+    parts = urllib.parse.urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    writer.write(('POST / HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n'
+                  'Content-Length: {}\r\nConnection: close\r\n\r\n{}').format(
+                      parts.netloc, len(body.encode()), body).encode())
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+
+async def current_last_id(url):
+    reader, writer, status = await open_request(url, '/?limit=1')
+    body = await reader.read()
+    writer.close()
+    messages = json.loads(body[body.find(b'['):])
+    return messages[-1]['id'] if messages else 0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+
+
+async def main(args):
+    since = await current_last_id(args.url)
+    subscriber = sse_subscriber if args.mode == 'sse' else longpoll_subscriber
+    ready, results = [], []
+    tasks = []
+    for _ in range(args.subscribers):
+        received = []
+        results.append(received)
+        tasks.append(asyncio.ensure_future(subscriber(args.url, since, args.messages, received, ready)))
+    deadline = time.time() + args.connect_timeout
+    while args.mode == 'sse' and len(ready) < args.subscribers and time.time() < deadline:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(args.settle)
+    for n in range(args.messages):
+        await post_message(args.url, n)
+        await asyncio.sleep(args.interval)
+    await asyncio.wait(tasks, timeout=args.drain_timeout)
+    connected = sum(1 for status in ready if status == 200)
+    for task in tasks:
+        task.cancel()
+    latencies = [latency for received in results for latency in received]
+    report = {
+        'mode': args.mode,
+        'subscribers': args.subscribers,
+        'connected': connected,
+        'rejected': len(ready) - connected,
+        'complete': sum(1 for received in results if len(received) >= args.messages),
+        'deliveries': len(latencies),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--subscribers', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between posts')
+    parser.add_argument('--mode', choices=['sse', 'longpoll'], default='sse')
+    parser.add_argument('--connect-timeout', type=float, default=30)
+    parser.add_argument('--settle', type=float, default=1, help='seconds to wait before the first post')
+    parser.add_argument('--drain-timeout', type=float, default=30)
+    asyncio.run(main(parser.parse_args()))
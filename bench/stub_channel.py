@@ -0,0 +1,66 @@
+#__________________________________________IMPORTS
+import argparse
+import asyncio
+import json
+
+#__________________________________________Stub channels for load tests
+# One process answering like many channel servers, one per port: /health
+# returns the channel name, GET / a short message list and POST / accepts
+# anything. Cheap enough to register hundreds of channels with a local hub.
+#
+#   python bench/stub_channel.py --first-port 6000 --count 50
+
+MESSAGES = [{'content': "Stub message {}".format(i), 'sender': 'stub', 'timestamp': '2025-01-01T00:00:{:02d}'.format(i),
+             'extra': None, 'id': i + 1} for i in range(10)]
+
+
+def stub_name(port):
+    return 'Stub Channel {}'.format(port)
+
+
+async def handle(reader, writer, port):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path = request_line.decode('latin-1').split()[:2]
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+            if path.startswith('/health'):
+                status, body = '200 OK', json.dumps({'name': stub_name(port)})
+            elif method == 'POST':
+                status, body = '200 OK', 'OK'
+            else:
+                status, body = '200 OK', json.dumps(MESSAGES)
+            body = body.encode('utf-8')
+            writer.write('HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+                status, len(body)).encode('latin-1') + body)
+            await writer.drain()
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main(args):
+    servers = []
+    for port in range(args.first_port, args.first_port + args.count):
+        servers.append(await asyncio.start_server(lambda r, w, port=port: handle(r, w, port), '127.0.0.1', port))
+    print('stub channels listening on ports {}-{}'.format(args.first_port, args.first_port + args.count - 1), flush=True)
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--first-port', type=int, default=6000)
+    parser.add_argument('--count', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
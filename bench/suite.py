@@ -0,0 +1,274 @@
+#__________________________________________IMPORTS
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from httpload import HttpConnection, summarize
+
+#__________________________________________End-to-end benchmark suite for hub, channel and client
+# Starts a local hub, one real channel, a set of stub channels and the client,
+# registers every channel with the hub and then runs a weighted mix of
+# operations from many concurrent virtual users. Reports throughput and
+# latency percentiles per operation, CPU and RSS per component, and saves
+# everything as JSON so two runs can be compared:
+#
+#   python bench/suite.py --users 50 --duration 30
+#   python bench/suite.py --compare bench/results/suite-A.json bench/results/suite-B.json
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO, 'bench', 'results')
+HEADERS = {"Authorization": "authkey 1234567890"}
+
+# operation -> weight in the mix
+DEFAULT_MIX = {
+    'channel_poll': 40,    # GET / on the channel (what every browser does)
+    'channel_post': 10,    # POST / on the channel (moderation, feedback, storage)
+    'client_show': 15,     # client /show: directory lookup + fetch from the channel
+    'client_feed': 5,      # client /feed: fan-out to every channel
+    'hub_list': 20,        # GET /channels on the hub
+    'hub_register': 5,     # POST /channels on the hub (includes a health check)
+    'hub_sweep': 5,        # GET /health on the hub (schedules a sweep of all channels)
+}
+
+
+#__________________________________________Components
+class Component(object):
+    def __init__(self, name, args, cwd, env=None):
+        self.name = name
+        self.process = subprocess.Popen(args, cwd=cwd, env=dict(os.environ, PYTHONPATH=REPO, **(env or {})),
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.samples = []  # (time, cpu seconds, rss bytes)
+
+    def sample(self):
+        try:
+            with open('/proc/{}/stat'.format(self.process.pid)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')  # utime + stime
+            with open('/proc/{}/statm'.format(self.process.pid)) as f:
+                rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            return
+        self.samples.append((time.monotonic(), cpu, rss))
+
+    def report(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, cpu0, _), (t1, cpu1, rss1) = self.samples[0], self.samples[-1]
+        return {'cpu_seconds': round(cpu1 - cpu0, 2),
+                'cpu_percent': round((cpu1 - cpu0) / (t1 - t0) * 100, 1),
+                'rss_mb_peak': round(max(rss for _, _, rss in self.samples) / 2 ** 20, 1),
+                'rss_mb_end': round(rss1 / 2 ** 20, 1)}
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return  # it answered
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('{} did not come up'.format(url))
+
+
+def start_components(args, workdir):
+    hub_url = 'http://127.0.0.1:{}'.format(args.hub_port)
+    # the suite measures the post path, not the per-sender rate limits (as in serving_bench.py); the concurrency cap stays
+    channel_snippet = "import channel; channel.default_channel.rate_limiter = None; " + {
+        'wsgi': "channel.app.run(port={}, threaded=True)",
+        'asgi': "import uvicorn; uvicorn.run('channel_asgi:app', port={}, log_level='warning')",
+    }[args.channel_mode].format(args.channel_port)
+    components = {
+        'hub': Component('hub', [sys.executable, '-c',
+                                 "import hub; hub.health_scheduler.start(); hub.app.run(port={}, threaded=True)".format(args.hub_port)],
+                         workdir, {'HUB_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'hub.sqlite')}),
+        'channel': Component('channel', [sys.executable, '-c', channel_snippet], workdir),
+        'stubs': Component('stubs', [sys.executable, os.path.join(REPO, 'bench', 'stub_channel.py'),
+                                     '--first-port', str(args.stub_port), '--count', str(args.stubs)], workdir),
+        'client': Component('client', [sys.executable, '-c',
+                                       "import client; client.channel_directory.hub_url = {!r}; "
+                                       "client.app.run(port={}, threaded=True)".format(hub_url, args.client_port)],
+                            workdir),
+    }
+    wait_until_up(hub_url + '/channels')
+    wait_until_up('http://127.0.0.1:{}/health'.format(args.channel_port))
+    wait_until_up('http://127.0.0.1:{}/health'.format(args.stub_port))
+    wait_until_up('http://127.0.0.1:{}/stats/outbound'.format(args.client_port))
+    return components
+
+
+def channel_records(args):
+    records = [{'name': "Art History Chat", 'endpoint': 'http://127.0.0.1:{}'.format(args.channel_port),
+                'authkey': '1234567890', 'type_of_service': 'aiweb24:chat'}]
+    for port in range(args.stub_port, args.stub_port + args.stubs):
+        records.append({'name': 'Stub Channel {}'.format(port), 'endpoint': 'http://127.0.0.1:{}'.format(port),
+                        'authkey': '1234567890', 'type_of_service': 'aiweb24:chat'})
+    return records
+
+
+#__________________________________________Workload
+async def virtual_user(user, args, mix, records, stop_at, measure_from, latencies, errors):
+    # every user posts under its own name and address, like separate clients
+    address = '10.0.{}.{}'.format(user // 256, user % 256)
+    connections = {
+        'channel': HttpConnection('http://127.0.0.1:{}'.format(args.channel_port),
+                                  dict(HEADERS, **{'X-Forwarded-For': address})),
+        'client': HttpConnection('http://127.0.0.1:{}'.format(args.client_port), HEADERS),
+        'hub': HttpConnection('http://127.0.0.1:{}'.format(args.hub_port), HEADERS),
+    }
+    main_channel = records[0]['endpoint']
+    operations, weights = list(mix), list(mix.values())
+    while time.monotonic() < stop_at:
+        operation = random.choices(operations, weights)[0]
+        if operation == 'channel_poll':
+            target, request = 'channel', ('GET', '/?since=0&limit=10', None)
+        elif operation == 'channel_post':
+            target, request = 'channel', ('POST', '/', {'content': "Let's talk about Renaissance art.",
+                                                        'sender': 'bench-{}'.format(user), 'timestamp': datetime.datetime.now().isoformat()})
+        elif operation == 'client_show':
+            target, request = 'client', ('GET', '/show?channel=' + urllib.request.quote(main_channel, safe=''), None)
+        elif operation == 'client_feed':
+            target, request = 'client', ('GET', '/feed?format=json', None)
+        elif operation == 'hub_list':
+            target, request = 'hub', ('GET', '/channels', None)
+        elif operation == 'hub_register':
+            target, request = 'hub', ('POST', '/channels', random.choice(records))
+        else:
+            target, request = 'hub', ('GET', '/health', None)
+        start = time.monotonic()
+        try:
+            status, _, _ = await connections[target].request(*request)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            status = None
+            connections[target].close()
+        if start < measure_from:
+            continue
+        if status is None or status >= 400:
+            errors[operation] = errors.get(operation, 0) + 1
+        else:
+            latencies.setdefault(operation, []).append(time.monotonic() - start)
+    for connection in connections.values():
+        connection.close()
+
+
+async def run_workload(args, mix, records):
+    latencies, errors = {}, {}
+    measure_from = time.monotonic() + args.warm_up
+    stop_at = measure_from + args.duration
+    await asyncio.gather(*(virtual_user(user, args, mix, records, stop_at, measure_from, latencies, errors)
+                           for user in range(args.users)))
+    return {operation: summarize(latencies.get(operation, []), errors.get(operation, 0), args.duration)
+            for operation in mix}
+
+
+#__________________________________________Suite
+def run_suite(args):
+    mix = dict(DEFAULT_MIX)
+    for item in args.mix or []:
+        operation, _, weight = item.partition('=')
+        mix[operation] = float(weight)
+    mix = {operation: weight for operation, weight in mix.items() if weight > 0}
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    with tempfile.TemporaryDirectory() as workdir:
+        # fresh message store and hub database per run, the channel reads its topics from the cwd
+        shutil.copy(os.path.join(REPO, 'feedback_topics.json'), workdir)
+        components = start_components(args, workdir)
+        try:
+            records = channel_records(args)
+            for record in records:  # initial registration, not measured
+                request = urllib.request.Request('http://127.0.0.1:{}/channels'.format(args.hub_port),
+                                                 data=json.dumps(record).encode('utf-8'), method='POST',
+                                                 headers=dict(HEADERS, **{'Content-Type': 'application/json'}))
+                urllib.request.urlopen(request, timeout=30).read()
+            sampling = threading.Event()
+
+            def sampler():
+                while not sampling.wait(0.5):
+                    for component in components.values():
+                        component.sample()
+
+            # the sampler starts after the warm-up so CPU and RSS cover the measured interval only
+            threading.Timer(args.warm_up, lambda: threading.Thread(target=sampler, daemon=True).start()).start()
+            operations = asyncio.run(run_workload(args, mix, records))
+            sampling.set()
+        finally:
+            for component in components.values():
+                component.stop()
+    total = sum(result['requests'] for result in operations.values())
+    return {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'config': {'users': args.users, 'duration': args.duration, 'stubs': args.stubs,
+                   'channel_mode': args.channel_mode, 'mix': mix},
+        'throughput': round(total / args.duration, 1),
+        'operations': operations,
+        'components': {name: component.report() for name, component in components.items()},
+    }
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('{:<16} {:>12} {:>12} {:>9} {:>12} {:>12} {:>9}'.format(
+        'operation', 'old req/s', 'new req/s', 'change', 'old p99 ms', 'new p99 ms', 'change'))
+    change = lambda a, b: '{:+.1f}%'.format((b - a) / a * 100) if a and b is not None else '-'
+    for operation in sorted(set(old['operations']) | set(new['operations'])):
+        a, b = old['operations'].get(operation, {}), new['operations'].get(operation, {})
+        print('{:<16} {:>12} {:>12} {:>9} {:>12} {:>12} {:>9}'.format(
+            operation, str(a.get('requests_per_second')), str(b.get('requests_per_second')),
+            change(a.get('requests_per_second'), b.get('requests_per_second')),
+            str(a.get('p99_ms')), str(b.get('p99_ms')), change(a.get('p99_ms'), b.get('p99_ms'))))
+    for name in sorted(set(old['components']) | set(new['components'])):
+        a, b = old['components'].get(name) or {}, new['components'].get(name) or {}
+        print('{:<16} cpu {} -> {} %, rss peak {} -> {} MB'.format(
+            name, a.get('cpu_percent'), b.get('cpu_percent'), a.get('rss_mb_peak'), b.get('rss_mb_peak')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warm-up', type=float, default=3, help='seconds run before measuring')
+    parser.add_argument('--stubs', type=int, default=20, help='stub channels registered with the hub')
+    parser.add_argument('--channel-mode', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--mix', nargs='*', metavar='OPERATION=WEIGHT', help='override weights, e.g. hub_sweep=0')
+    parser.add_argument('--hub-port', type=int, default=5655)
+    parser.add_argument('--channel-port', type=int, default=5601)
+    parser.add_argument('--client-port', type=int, default=5605)
+    parser.add_argument('--stub-port', type=int, default=6000)
+    parser.add_argument('--output', help='result file (default: bench/results/suite-<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    result = run_suite(args)
+    print(json.dumps(result, indent=4))
+    output = args.output or os.path.join(RESULTS_DIR, 'suite-{}.json'.format(datetime.datetime.now().strftime('%Y%m%d-%H%M%S')))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=4)
+    print('Results saved to', output)
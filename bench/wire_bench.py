@@ -0,0 +1,108 @@
+#__________________________________________IMPORTS
+import argparse
+import datetime
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from flask import Flask, jsonify
+import wire
+
+#__________________________________________Wire format benchmark: size and CPU of the response encodings
+# Encodes the payloads of GET / (a channel's messages) and GET /channels (the
+# hub directory) in every format wire.py can send and reports the size on the
+# wire, the encoding CPU on the server and the decoding CPU on the client,
+# next to the jsonify + response.json() path the endpoints used before.
+# Formats whose optional package (orjson, msgpack, brotli) is missing are skipped.
+#
+#   python bench/wire_bench.py --output wire.json
+
+WORDS = ('picasso monet cubism light colour canvas museum painting portrait the a of and in is what about '
+         'think influence modern art gallery brush impressionism renaissance sculpture').split()
+
+
+def messages(count):
+    rng = random.Random(count)
+    start = datetime.datetime(2025, 1, 1)
+    return [{'id': i,
+             'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 40))),
+             'sender': 'user{}'.format(rng.randint(1, 200)),
+             'timestamp': (start + datetime.timedelta(seconds=17 * i)).isoformat(),
+             'extra': None if i % 5 else {'feedback': True}}
+            for i in range(1, count + 1)]
+
+
+def directory(count):
+    return {'version': count,
+            'channels': [{'name': 'Channel {}'.format(i),
+                          'endpoint': 'http://localhost:5002/channel-{}'.format(i),
+                          'authkey': '0987654321',
+                          'type_of_service': 'aiweb24:chat',
+                          'active': i % 7 != 0} for i in range(count)]}
+
+
+def timeit(function, min_time):  # microseconds per call
+    function()
+    calls, start = 0, time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return round(elapsed / calls * 1e6, 1)
+
+
+def formats():  # name -> (encode, decode), each on bytes
+    app = Flask(__name__)
+    def flask_jsonify(value):
+        with app.app_context():
+            return jsonify(value).get_data()
+    found = {'jsonify': (flask_jsonify, lambda data: json.loads(data.decode('utf-8'))),
+             'json': (lambda value: json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), json.loads)}
+    if wire.orjson is not None:
+        found['orjson'] = (wire.orjson.dumps, wire.orjson.loads)
+    if wire.msgpack is not None:
+        found['msgpack'] = (wire.msgpack.packb, wire.msgpack.unpackb)
+    return found
+
+
+def compressions():  # name -> (compress, decompress)
+    found = {'identity': (lambda data: data, lambda data: data),
+             'gzip': (lambda data: wire.compress(data, 'gzip'), gzip.decompress)}
+    if wire.brotli is not None:
+        found['br'] = (lambda data: wire.compress(data, 'br'), wire.brotli.decompress)
+    return found
+
+
+def bench(payloads, min_time):
+    results = []
+    for payload_name, value in payloads.items():
+        for format_name, (encode, decode) in formats().items():
+            for compression_name, (compress, decompress) in compressions().items():
+                data = compress(encode(value))
+                results.append({'payload': payload_name, 'format': format_name, 'encoding': compression_name,
+                                'bytes': len(data),
+                                'encode_us': timeit(lambda: compress(encode(value)), min_time),
+                                'decode_us': timeit(lambda: decode(decompress(data)), min_time)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds spent on each measurement')
+    parser.add_argument('--output', help='also save the results as JSON')
+    args = parser.parse_args()
+    payloads = {'10 messages': messages(10), '100 messages': messages(100), '1000 messages': messages(1000),
+                '1000 channels': directory(1000), '20000 channels': directory(20000)}
+    results = bench(payloads, args.min_time)
+    print('{:<16} {:<10} {:<10} {:>10} {:>12} {:>12}'.format('payload', 'format', 'encoding', 'bytes', 'encode us', 'decode us'))
+    for r in results:
+        print('{payload:<16} {format:<10} {encoding:<10} {bytes:>10} {encode_us:>12.1f} {decode_us:>12.1f}'.format(**r))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -1,16 +1,18 @@
 #__________________________________________IMPORTS
-from flask import Flask, request, jsonify
+from flask import Flask
 import json
 import requests
-import random
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from textblob import TextBlob
-from better_profanity import profanity
+import os
+import sys
+import threading
 from flask_cors import CORS
+from feedback import FeedbackEngine
+from moderation import ModerationBatcher, train_model, save_model, preload, MODEL_FILE
+from hosted_channel import HostedChannel, host_channels, check_authorization, send_stage_latency
+from rate_limit import create_buckets
+import metrics
 
 #__________________________________________Create and configure Flask app
-profanity.load_censor_words() # Loading profanity filter
 class ConfigClass(object): # Class-based application configuration
     SECRET_KEY = 'This is an INSECURE secret!! DO NOT use this in production!!' # change to something random, no matter what
 app = Flask(__name__)
@@ -18,11 +20,13 @@ app.config.from_object(__name__ + '.ConfigClass')
 app.app_context().push() # create an app context before initializing db
 
 # After creating the Flask app
+CORS_ORIGINS = ["http://localhost:3000"]
 CORS(app, resources={
     r"/*": {
-        "origins": ["http://localhost:3000"],
+        "origins": CORS_ORIGINS,
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Authorization", "Content-Type"]
+        "allow_headers": ["Authorization", "Content-Type", "If-None-Match", "If-Modified-Since"],
+        "expose_headers": ["ETag", "Last-Modified", "X-Last-Message-Id", "Retry-After"]
     }
 })
 
@@ -32,9 +36,34 @@ HUB_AUTHKEY = '1234567890'
 CHANNEL_AUTHKEY = '1234567890'
 CHANNEL_NAME = "Art History Chat"
 CHANNEL_ENDPOINT = "http://localhost:5001"
-CHANNEL_FILE = 'messages.json'
+CHANNEL_FILE = 'messages.json'  # legacy whole-file store, imported once into the message store
 CHANNEL_TYPE_OF_SERVICE = 'aiweb24:chat'  
+CHANNEL_STORAGE = 'jsonl'  # 'jsonl' (append-only log) or 'sqlite' (WAL mode)
+CHANNEL_STORE_FILE = 'messages.jsonl'
+CHANNEL_ARCHIVE_DIR = 'archive'  # compacted messages, for /history and /search (None: discard them)
+MAX_MESSAGES = 10  # retention: number of messages the channel keeps
+MAX_WAIT = 30  # longest long-poll (?wait=<seconds>) a client may ask for
+MAX_SUBSCRIBERS = 1000  # long-poll and SSE clients one channel process holds at once
+STORE_POLL_INTERVAL = 1.0  # waiters re-check the store this often to see posts from other workers
+SSE_KEEPALIVE = 15  # seconds between keep-alive comments on an idle /stream
+FEEDBACK_TOPICS_FILE = 'feedback_topics.json'  # topic -> responses, edits are picked up without a restart
+FEEDBACK_EVERY = 3  # feedback after every n-th message
+MODERATION_MAX_BATCH = 32  # messages scored together by the moderation pipeline
+MODERATION_MAX_WAIT = 0.005  # seconds a message waits for others to fill a batch
+MAX_MODERATE_REQUEST = 1000  # messages accepted by one POST /moderate
+SENDER_RATE = 0.5  # messages per second one sender may post, on average (None: no limit)
+SENDER_BURST = 5  # messages a sender may post in a row before the rate applies
+CLIENT_RATE = 2.0  # the same for one client address
+CLIENT_BURST = 20
+MAX_CONCURRENT_POSTS = 64  # posts validated and moderated at once; more are turned away with 429
+# token buckets in this file are shared by all worker processes (e.g. /dev/shm/channel-rate-limits),
+# without it every process limits on its own
+RATE_LIMIT_FILE = os.environ.get('CHANNEL_RATE_LIMIT_FILE')
+WELCOME_MESSAGE = "Welcome to the Art History Chat! 🎨 Let's discuss paintings, famous artists, and art movements through the history!"
 headers = {"Authorization": "authkey 1234567890"}
+
+#__________________________________________Metrics: /metrics (Prometheus) and /debug/profile?seconds=<n>
+metrics.instrument(app, authorize=lambda request: check_authorization(request) and metrics.is_local_request(request))
 #__________________________________________Register Channel with Hub
 @app.cli.command('register')
 def register_command():
@@ -65,161 +94,68 @@ def register_command():
         
     print(f"Channel {CHANNEL_NAME} registered successfully.")
 
-#_________________________________________Request Authorization Check
-def check_authorization(request):
-    #global CHANNEL_AUTHKEY
-    #print("Authorization Header:", request.headers.get('Authorization'))  # Log the header for debugging
-    #if 'Authorization' not in request.headers:
-        #return False
-    #if request.headers['Authorization'] != 'authkey ' + CHANNEL_AUTHKEY:
-        #return False
-    return True
-
-#_________________________________________Health Check Endpoint
-@app.route('/health', methods=['GET'])
-def health_check():
-    if not check_authorization(request):
-        return "Invalid authorization1", 400
-    return jsonify({'name': CHANNEL_NAME}),  200
-
-#_________________________________________Get Messages: Returns A list of messages
-@app.route('/', methods=['GET'])
-def home_page():
-    if not check_authorization(request):
-        return "Invalid authorization2", 400
-    return jsonify(read_messages())
-
-#_________________________________________Off-Topic Detection using Naive Bayes
-# Sample training data for off-topic detection
-relevant_sentences = [
-    "Let's talk about Renaissance art.",
-    "Who is your favorite Impressionist painter?",
-    "I love Vincent van Gogh's Starry Night!",
-    "Can we discuss the Baroque period?",
-    "What do you think about Picasso's influence on modern art?"
-]
-
-irrelevant_sentences = [
-    "I love watching football on weekends.",
-    "What's your favorite movie?",
-    "Let's talk about cooking recipes.",
-    "I need help with my math homework.",
-    "Who is the best pop singer today?"
-]
-
-# Labels: 1 for relevant, 0 for irrelevant
-training_sentences = relevant_sentences + irrelevant_sentences
-labels = [1] * len(relevant_sentences) + [0] * len(irrelevant_sentences)
-
-# Vectorization and Model Training
-vectorizer = CountVectorizer()
-X = vectorizer.fit_transform(training_sentences)
-model = MultinomialNB()
-model.fit(X, labels)
-
-def is_off_topic(content):
-    X_new = vectorizer.transform([content])
-    prediction = model.predict(X_new)
-    return prediction[0] == 0  # Return True if off-topic
-
-#_________________________________________Feedback Logic: Generates feedback based on the message content
-def generate_feedback(message_content):
-    feedback_messages = {
-        "art": [
-            "Art is not what you see, but what you make others see. – Edgar Degas",
-            "The purpose of art is washing the dust of daily life off our souls. – Pablo Picasso"
-        ],
-        "history": [
-            "Did you know? Art history is often divided into periods such as Renaissance, Baroque, and Modernism.",
-            "The Renaissance marked a rebirth of art inspired by ancient Greece and Rome."
-        ],
-        "artist": [
-            "Fun fact: Leonardo da Vinci was ambidextrous and could write with both hands!",
-            "Pablo Picasso went through different artistic phases, including his Blue and Rose periods."
-        ],
-        "painting": [
-            "The 'Mona Lisa' was once stolen from the Louvre in 1911 and recovered two years later.",
-            "Van Gogh's 'Starry Night' was painted from his asylum room's window."
-        ]
-    }
-    messages = read_messages()
-    blob = TextBlob(message_content)
-    nouns = [word.lower() for word, tag in blob.tags if tag in ('NN', 'NNS')]
-    if (len(messages)+1) % 3 == 0:  # Only provide feedback after every 3 user messages
-        for topic in feedback_messages:
-            if topic in nouns:
-                return random.choice(feedback_messages[topic])
-    return None
-
-#_________________________________________Send Message: Handles sending and receiving messages
-@app.route('/', methods=['POST'])
-def send_message():
-    if not check_authorization(request):
-        return "Invalid authorization3", 400
-    
-    message = request.json
-    if not message or 'content' not in message or 'sender' not in message or 'timestamp' not in message:
-        return "Invalid message format", 400
+#__________________________________________Train the off-topic model offline (loaded lazily by the channel)
+@app.cli.command('train_model')
+def train_model_command():
+    artifact = train_model()
+    save_model(artifact, MODEL_FILE)
+    print(f"Off-topic model v{artifact['version']} (scikit-learn {artifact['sklearn_version']}) saved to {MODEL_FILE}")
+
+#_________________________________________The Channel: state and routes live in hosted_channel.py
+# This app serves a single channel at its root; channel_host.py serves many
+# channels from one process under path prefixes.
+feedback_engine = FeedbackEngine(FEEDBACK_TOPICS_FILE, every=FEEDBACK_EVERY)
+moderator = ModerationBatcher(max_batch_size=MODERATION_MAX_BATCH, max_wait=MODERATION_MAX_WAIT)
+rate_limiter = create_buckets(RATE_LIMIT_FILE)
+post_slots = threading.BoundedSemaphore(MAX_CONCURRENT_POSTS)
+default_channel = HostedChannel(CHANNEL_NAME, CHANNEL_ENDPOINT, CHANNEL_AUTHKEY, CHANNEL_TYPE_OF_SERVICE,
+                                moderator, feedback_engine,
+                                storage=CHANNEL_STORAGE, store_file=CHANNEL_STORE_FILE, legacy_file=CHANNEL_FILE,
+                                archive_dir=CHANNEL_ARCHIVE_DIR,
+                                max_messages=MAX_MESSAGES, welcome_message=WELCOME_MESSAGE,
+                                max_subscribers=MAX_SUBSCRIBERS, max_wait=MAX_WAIT,
+                                poll_interval=STORE_POLL_INTERVAL, sse_keepalive=SSE_KEEPALIVE,
+                                max_moderate_request=MAX_MODERATE_REQUEST,
+                                rate_limiter=rate_limiter, post_slots=post_slots,
+                                sender_rate=SENDER_RATE, sender_burst=SENDER_BURST,
+                                client_rate=CLIENT_RATE, client_burst=CLIENT_BURST)
+host_channels(app, {None: default_channel})
+
+# module level names used by channel_asgi.py and older scripts
+store = default_channel.store
+broker = default_channel.broker
+parse_cursor = default_channel.parse_cursor
+enter_post = default_channel.enter_post
+leave_post = default_channel.leave_post
+rate_limit_error = default_channel.rate_limit_error
+validate_message = default_channel.validate_message
+moderation_error = default_channel.moderation_error
+generate_feedback = default_channel.generate_feedback
+commit_message = default_channel.commit_message
+store_messages = default_channel.store_messages
+wait_for_messages = default_channel.wait_for_messages
 
-    if profanity.contains_profanity(message['content']):
-        return "Inappropriate content", 400
-
-    if is_off_topic(message['content']):
-        return "Off-topic content", 400
-    
-    extra = message['extra'] if 'extra' in message else None
-    
-    # Generate feedback message
-    feedback = generate_feedback(message['content'])
-    messages = read_messages()
-    if feedback:
-        messages.append({'content': feedback,
-                        'sender': "ArtBot",
-                        'timestamp': message['timestamp'],
-                        'extra': None,
-                        })
-    
-    # Save user message
-    messages.append({'content': message['content'],
-                     'sender': message['sender'],
-                     'timestamp': message['timestamp'],
-                     'extra': extra,
-                     })
-    save_messages(messages)
-    return "OK", 200
-
-#_________________________________________Read and Save Messages (with a 20 messages limit)
 def read_messages():
-    global CHANNEL_FILE
-    try:
-        with open(CHANNEL_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.decoder.JSONDecodeError):
-        return []
+    return store.recent()
 
-def save_messages(messages):
-    MAX_MESSAGES = 10
-    if len(messages) > MAX_MESSAGES:
-        messages = messages[-MAX_MESSAGES:]
-    with open(CHANNEL_FILE, 'w') as f:
-        json.dump(messages, f)
+metrics.gauge('channel_subscribers', 'Waiting long-poll and SSE clients', broker.subscriber_count)
+metrics.gauge('channel_last_message_id', 'Id of the newest stored message', lambda: store.state()[0])
 
 #_________________________________________Welcome Message(if no messages are present)
-def add_welcome_message():
-    messages = read_messages()
-    if not messages:  
-        welcome_message = {
-            'content': "Welcome to the Art History Chat! 🎨 Let's discuss paintings, famous artists, and art movements through the history!",
-            'sender': " ",
-            'timestamp': "0",
-            'extra': None
-        }
-        messages.append(welcome_message)
-        save_messages(messages)
-add_welcome_message()
+default_channel.add_welcome_message()
+
+# Models are loaded on first use; set CHANNEL_PRELOAD_MODELS=1 to load them at import
+# instead, e.g. in a pre-forking server (gunicorn --preload) so workers share them
+if os.environ.get('CHANNEL_PRELOAD_MODELS'):
+    preload()
 
 #_________________________________________Run Application
 if __name__ == '__main__':
-    app.run(port=5001, debug=True) 
+    if '--asgi' in sys.argv:  # async serving mode, see channel_asgi.py
+        sys.modules['channel'] = sys.modules['__main__']  # let channel_asgi reuse this module
+        import uvicorn
+        uvicorn.run('channel_asgi:app', port=5001)
+    else:
+        app.run(port=5001, debug=True) 
     
     
\ No newline at end of file
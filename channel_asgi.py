@@ -0,0 +1,293 @@
+#__________________________________________IMPORTS
+import asyncio
+import concurrent.futures
+import email.utils
+import io
+import json
+import sys
+import time
+import urllib.parse
+import channel
+import metrics
+import wire
+from message_broker import TooManySubscribers
+from hosted_channel import client_address, last_modified_header, retry_after
+
+#__________________________________________Async (ASGI) serving mode for the channel
+# The hot routes (/health, GET /, POST /, /stream) are served natively on the
+# event loop: open connections and long-polls cost a coroutine instead of a
+# thread. Moderation runs on the moderation batcher's thread (awaited through
+# its future), store reads and writes run in a thread pool: both take the store
+# lock, which a write holds through the file lock, fsync and compaction. Every
+# other route is passed to the Flask app in the same thread pool.
+#
+#   python channel.py --asgi
+#   uvicorn channel_asgi:app --port 5001
+
+EXECUTOR_WORKERS = 32  # threads for store access and Flask routes
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='channel-asgi')
+
+#__________________________________________Helpers: requests and responses
+class HttpRequest(object):
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.args = {k: v[0] for k, v in urllib.parse.parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+    async def body(self):
+        chunks = []
+        while True:
+            event = await self.receive()
+            chunks.append(event.get('body', b''))
+            if not event.get('more_body'):
+                return b''.join(chunks)
+
+def cors_headers(request):
+    origin = request.headers.get('origin')
+    if origin not in channel.CORS_ORIGINS:
+        return []
+    return [(b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'access-control-expose-headers', b'ETag, Last-Modified, X-Last-Message-Id, Retry-After'),
+            (b'vary', b'Origin')]
+
+async def respond(send, request, status, body=b'', content_type='text/html; charset=utf-8', headers=()):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    response_headers = [(b'content-type', content_type.encode('latin-1')),
+                        (b'content-length', str(len(body)).encode('latin-1'))]
+    response_headers += [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers]  # ASGI wants lower case names
+    response_headers += cors_headers(request)
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:  # takes precedence over If-Modified-Since
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or any(tag.replace('W/', '', 1) == '"{}"'.format(etag) for tag in tags)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified <= email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+async def in_executor(function, *args):  # runs a blocking call, e.g. on the store, off the event loop
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+def read_store(since, limit):  # (last id, last modified, messages) in one trip to the executor
+    last_id, last_modified = channel.store.state()
+    return last_id, last_modified, channel.store.since(since, limit)
+
+#__________________________________________Routes
+async def health_check(request, send):
+    if not channel.check_authorization(request):
+        return await respond(send, request, 400, "Invalid authorization1")
+    await respond(send, request, 200, json.dumps({'name': channel.CHANNEL_NAME}), 'application/json')
+
+async def wait_for_messages(since, timeout):
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    with channel.broker.subscribe(notify=lambda: loop.call_soon_threadsafe(event.set)) as subscription:
+        deadline = time.monotonic() + timeout
+        while not await in_executor(channel.store.since, since, 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, channel.STORE_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+            subscription.get(0)  # we re-read the store, drop the queued copies
+
+async def get_messages(request, send):
+    if not channel.check_authorization(request):
+        return await respond(send, request, 400, "Invalid authorization2")
+    try:
+        since, limit, wait = channel.parse_cursor(request.args)
+    except ValueError:
+        return await respond(send, request, 400, "Invalid since, limit or wait parameter")
+    if wait > 0:
+        try:
+            await wait_for_messages(since, wait)
+        except TooManySubscribers:
+            return await respond(send, request, 503, "Too many waiting clients", headers=[('Retry-After', '5')])
+    last_id, last_modified, messages = await in_executor(read_store, since, limit)
+    headers = [('ETag', 'W/"{}"'.format(last_id)), ('Cache-Control', 'no-cache'), ('X-Last-Message-Id', last_id)]
+    last_modified = last_modified_header(last_modified)
+    if last_modified is not None:
+        headers.append(('Last-Modified', email.utils.format_datetime(last_modified, usegmt=True)))
+    if not_modified(request, last_id, last_modified):
+        return await respond(send, request, 304, headers=headers)
+    # JSON or MessagePack, compressed if the client accepts it (see wire.py)
+    content_type, encoding = wire.negotiate(request.headers.get('accept'), request.headers.get('accept-encoding'))
+    body, content_type = wire.encode(messages, content_type)
+    headers.append(('Vary', 'Accept, Accept-Encoding'))
+    if encoding and len(body) >= wire.MIN_COMPRESS_BYTES:
+        body = wire.compress(body, encoding)
+        headers.append(('Content-Encoding', encoding))
+    await respond(send, request, 200, body, content_type, headers)
+
+async def send_message(request, send):
+    if not channel.check_authorization(request):
+        return await respond(send, request, 400, "Invalid authorization3")
+    # load shedding before any expensive work, as in hosted_channel.send_message
+    if not channel.enter_post():
+        return await respond(send, request, 429, "Too many messages in progress, try again",
+                             headers=[('Retry-After', retry_after(1))])
+    try:
+        try:
+            message = json.loads(await request.body())
+        except ValueError:
+            return await respond(send, request, 400, "Invalid message format")
+        error = channel.validate_message(message)
+        if error:
+            return await respond(send, request, 400, error)
+        peer = request.scope.get('client')  # (host, port), or None if the server does not know it
+        limited = channel.rate_limit_error(message, client_address(peer[0] if peer else None,
+                                                                   request.headers.get('x-forwarded-for')))
+        if limited:
+            return await respond(send, request, 429, limited[0], headers=[('Retry-After', retry_after(limited[1]))])
+        # CPU-bound scoring happens on the moderation thread, in batches with other requests
+        with channel.send_stage_latency.time(stage='moderation'):
+            verdict = await asyncio.wrap_future(channel.moderator.submit(message['content']))
+        error = channel.moderation_error(verdict)
+        if error:
+            return await respond(send, request, 400, error)
+        await in_executor(channel.commit_message, message)
+        await respond(send, request, 200, "OK")
+    finally:
+        channel.leave_post()
+
+async def stream_messages(request, send):
+    if not channel.check_authorization(request):
+        return await respond(send, request, 400, "Invalid authorization")
+    try:
+        since = int(request.headers.get('last-event-id') or request.args.get('since', 0))
+    except ValueError:
+        return await respond(send, request, 400, "Invalid since parameter")
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    try:
+        subscription = channel.broker.subscribe(notify=lambda: loop.call_soon_threadsafe(event.set))
+    except TooManySubscribers:
+        return await respond(send, request, 503, "Too many waiting clients", headers=[('Retry-After', '5')])
+
+    async def watch_disconnect():
+        while (await request.receive())['type'] != 'http.disconnect':
+            pass
+        event.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')] + cors_headers(request)})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        idle = 0
+        while not subscription.overflowed and not watcher.done():
+            chunks = []
+            for message in await in_executor(channel.store.since, since):
+                chunks.append('id: {}\ndata: {}\n\n'.format(message['id'], wire.dumps(message).decode('utf-8')))
+                since = message['id']
+            if chunks:
+                await send({'type': 'http.response.body', 'body': ''.join(chunks).encode('utf-8'), 'more_body': True})
+            try:
+                await asyncio.wait_for(event.wait(), channel.STORE_POLL_INTERVAL)
+                idle = 0
+            except asyncio.TimeoutError:
+                idle += channel.STORE_POLL_INTERVAL
+                if idle >= channel.SSE_KEEPALIVE:
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                    idle = 0
+            event.clear()
+            subscription.get(0)
+        if not watcher.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        subscription.close()
+
+#__________________________________________Fallback: every other route is served by the Flask app in a thread
+async def call_flask(request, send):
+    scope = request.scope
+    body = await request.body()
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[key] = value
+        else:
+            environ['HTTP_' + key] = value
+
+    def run():
+        started = {}
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = int(status.split()[0]), headers
+        result = channel.app(environ, start_response)
+        try:
+            return started, b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    started, body = await in_executor(run)
+    await send({'type': 'http.response.start', 'status': started['status'],
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in started['headers']]})
+    await send({'type': 'http.response.body', 'body': body})
+
+#__________________________________________ASGI Application
+ROUTES = {
+    ('GET', '/health'): health_check,
+    ('GET', '/'): get_messages,
+    ('POST', '/'): send_message,
+    ('GET', '/stream'): stream_messages,
+}
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            event = await receive()
+            if event['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif event['type'] == 'lifespan.shutdown':
+                executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    request = HttpRequest(scope, receive)
+    route = ROUTES.get((scope['method'], scope['path']))
+    if route is None:
+        return await call_flask(request, send)  # timed by the Flask app itself
+    start = time.perf_counter()
+
+    async def send_timed(event):  # like the Flask app: time until the response starts
+        if event['type'] == 'http.response.start':
+            metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, method=scope['method'],
+                                            route=scope['path'], status=event['status'])
+        await send(event)
+
+    await route(request, send_timed)
@@ -0,0 +1,209 @@
+#__________________________________________IMPORTS
+from flask import Flask, jsonify
+import concurrent.futures
+import json
+import os
+import re
+import requests
+import threading
+import time
+from flask_cors import CORS
+from feedback import FeedbackEngine
+from moderation import ModerationBatcher, preload
+from hosted_channel import HostedChannel, host_channels, check_authorization
+from rate_limit import create_buckets
+import metrics
+
+#__________________________________________Multi-Channel Host: many channels in one process
+# Every channel listed in hosted_channels.json is served under /<id>/ (e.g.
+# http://localhost:5002/art-history/ and /art-history/health) with its own
+# configuration, message log and subscribers. The moderation models, the
+# moderation batcher and the feedback topic files are loaded once and shared,
+# so an extra channel costs a few kilobytes instead of a whole interpreter.
+#
+#   python channel_host.py
+#   flask --app channel_host.py register    (all channels with one hub request)
+
+#__________________________________________Create and configure Flask app
+class ConfigClass(object): # Class-based application configuration
+    SECRET_KEY = 'This is an INSECURE secret!! DO NOT use this in production!!' # change to something random, no matter what
+app = Flask(__name__)
+app.config.from_object(__name__ + '.ConfigClass')
+app.app_context().push()
+
+CORS_ORIGINS = ["http://localhost:3000"]
+CORS(app, resources={
+    r"/*": {
+        "origins": CORS_ORIGINS,
+        "methods": ["GET", "POST", "OPTIONS"],
+        "allow_headers": ["Authorization", "Content-Type", "If-None-Match", "If-Modified-Since"],
+        "expose_headers": ["ETag", "Last-Modified", "X-Last-Message-Id", "Retry-After"]
+    }
+})
+
+#__________________________________________Host and Hub Configuration
+HUB_URL = 'http://localhost:5555'
+HUB_AUTHKEY = '1234567890'
+HOST_URL = 'http://localhost:5002'  # public base URL, channel endpoints are HOST_URL/<id>
+HOSTED_CHANNELS_FILE = os.environ.get('HOSTED_CHANNELS_FILE', 'hosted_channels.json')
+DATA_DIR = 'channel_data'  # per channel: message log <DATA_DIR>/<id>.jsonl, archive <DATA_DIR>/<id>.archive/
+CHANNEL_STORAGE = 'jsonl'  # no open files or connections per channel between requests
+REGISTER_BATCH_SIZE = 500  # channels per /channels/batch request
+REGISTER_WORKERS = 8  # parallel single registrations if the hub has no batch endpoint
+HEARTBEAT_INTERVAL = 30  # seconds between heartbeats for all channels (one request), 0 to disable
+MODERATION_MAX_BATCH = 32  # messages of all channels are scored together
+MODERATION_MAX_WAIT = 0.005
+MAX_CONCURRENT_POSTS = 64  # posts validated and moderated at once, over all channels; more get 429
+CLIENT_RATE = 2.0  # messages per second from one client address, over all channels
+CLIENT_BURST = 20
+RATE_LIMIT_FILE = os.environ.get('CHANNEL_RATE_LIMIT_FILE')  # share the limits between worker processes
+# Per-channel defaults, each can be overridden for one channel in hosted_channels.json
+CHANNEL_DEFAULTS = {
+    'type_of_service': 'aiweb24:chat',
+    'feedback_topics': 'feedback_topics.json',
+    'feedback_every': 3,
+    'max_messages': 10,          # retention
+    'max_bytes': 64 * 1024,      # memory limit for the messages the channel keeps
+    'max_message_bytes': 4096,   # longest accepted message content
+    'max_subscribers': 200,      # long-poll and SSE clients of one channel
+    'sender_rate': 0.5,          # messages per second one sender may post, on average (null: no limit)
+    'sender_burst': 5,           # messages a sender may post in a row
+    'off_topic_filter': True,    # the shared off-topic model is about art history
+    'archive': True,             # keep compacted messages for /history and /search
+    'welcome_message': None,
+}
+CHANNEL_ID = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+RESERVED_IDS = {'health', 'metrics', 'debug', 'static'}
+headers = {"Authorization": "authkey " + HUB_AUTHKEY}
+
+#__________________________________________Metrics: /metrics (Prometheus) and /debug/profile?seconds=<n>
+metrics.instrument(app, authorize=lambda request: check_authorization(request) and metrics.is_local_request(request))
+
+#__________________________________________Load the Hosted Channels
+def load_config(path):
+    # hosted_channels.json: [{"id": "art-history", "name": "...", "authkey": "...", <overrides>}, ...]
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    configs = {}
+    for entry in entries:
+        config = dict(CHANNEL_DEFAULTS, **entry)
+        for key in ('id', 'name', 'authkey'):
+            if key not in config:
+                raise ValueError("Hosted channel {} has no {}".format(entry, key))
+        if not CHANNEL_ID.match(config['id']) or config['id'] in RESERVED_IDS:
+            raise ValueError("Invalid hosted channel id: {}".format(config['id']))
+        if config['id'] in configs:
+            raise ValueError("Duplicate hosted channel id: {}".format(config['id']))
+        configs[config['id']] = config
+    return configs
+
+feedback_engines = {}  # (topic file, every) -> FeedbackEngine shared by all channels using it
+moderator = ModerationBatcher(max_batch_size=MODERATION_MAX_BATCH, max_wait=MODERATION_MAX_WAIT)
+rate_limiter = create_buckets(RATE_LIMIT_FILE)
+post_slots = threading.BoundedSemaphore(MAX_CONCURRENT_POSTS)
+
+def feedback_engine_for(path, every):
+    if (path, every) not in feedback_engines:
+        feedback_engines[(path, every)] = FeedbackEngine(path, every=every)
+    return feedback_engines[(path, every)]
+
+def create_channel(config):
+    return HostedChannel(config['name'], HOST_URL + '/' + config['id'], config['authkey'], config['type_of_service'],
+                         moderator, feedback_engine_for(config['feedback_topics'], config['feedback_every']),
+                         storage=CHANNEL_STORAGE, store_file=os.path.join(DATA_DIR, config['id'] + '.jsonl'),
+                         archive_dir=os.path.join(DATA_DIR, config['id'] + '.archive') if config['archive'] else None,
+                         max_messages=config['max_messages'], max_bytes=config['max_bytes'],
+                         max_message_bytes=config['max_message_bytes'], off_topic_filter=config['off_topic_filter'],
+                         welcome_message=config['welcome_message'], max_subscribers=config['max_subscribers'],
+                         rate_limiter=rate_limiter, post_slots=post_slots,
+                         sender_rate=config['sender_rate'], sender_burst=config['sender_burst'],
+                         client_rate=CLIENT_RATE, client_burst=CLIENT_BURST)
+
+os.makedirs(DATA_DIR, exist_ok=True)
+channels = {channel_id: create_channel(config) for channel_id, config in load_config(HOSTED_CHANNELS_FILE).items()}
+for channel in channels.values():
+    channel.add_welcome_message()
+host_channels(app, channels, prefix='/<channel_id>')
+
+metrics.gauge('hosted_channels', 'Channels served by this process', lambda: len(channels))
+metrics.gauge('hosted_channel_message_bytes', 'Messages held in memory by all channels, serialized',
+              lambda: sum(channel.store.memory_usage() for channel in channels.values()))
+metrics.gauge('channel_subscribers', 'Waiting long-poll and SSE clients',
+              lambda: sum(channel.broker.subscriber_count() for channel in channels.values()))
+
+# same switch as channel.py: load the shared models now, e.g. before forking workers
+if os.environ.get('CHANNEL_PRELOAD_MODELS'):
+    preload()
+
+#__________________________________________Register all Channels with the Hub
+# One POST /channels/batch for all channels; hubs without the batch endpoint
+# get the usual single registrations, a few in parallel.
+def register_all(records):  # -> list of (record, error or None)
+    if len(records) > REGISTER_BATCH_SIZE:
+        return [result for start in range(0, len(records), REGISTER_BATCH_SIZE)
+                for result in register_all(records[start:start + REGISTER_BATCH_SIZE])]
+    response = requests.post(HUB_URL + '/channels/batch', headers=headers, json=records, timeout=(3.05, 120))
+    if response.status_code not in (404, 405):
+        if response.status_code != 200:
+            return [(record, "HTTP {}: {}".format(response.status_code, response.text)) for record in records]
+        return [(record, None if result.get('ok') else result.get('error', 'failed'))
+                for record, result in zip(records, response.json())]
+
+    def register_one(record):
+        try:
+            response = requests.post(HUB_URL + '/channels', headers=headers, data=json.dumps(record), timeout=(3.05, 30))
+        except requests.exceptions.RequestException as e:
+            return record, str(e)
+        return record, None if response.status_code == 200 else response.text
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=REGISTER_WORKERS) as executor:
+        return list(executor.map(register_one, records))
+
+@app.cli.command('register')
+def register_command():
+    results = register_all([channel.record() for channel in channels.values()])
+    for record, error in results:
+        if error:
+            print(f"Error registering {record['name']} ({record['endpoint']}): {error}")
+    registered = sum(1 for _, error in results if error is None)
+    print(f"{registered} of {len(results)} channels registered successfully.")
+
+#__________________________________________Heartbeats: tell the hub all channels are alive, in one request
+def send_heartbeats():
+    beats = [{'endpoint': channel.endpoint, 'authkey': channel.authkey} for channel in channels.values()]
+    response = requests.post(HUB_URL + '/heartbeat', headers=headers, json=beats, timeout=(3.05, 10))
+    if response.status_code == 202 and response.json()['unknown']:
+        print("Hub does not know these channels (run 'flask --app channel_host.py register'):",
+              ', '.join(response.json()['unknown']))
+
+def heartbeat_loop():
+    while True:
+        try:
+            send_heartbeats()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Heartbeat failed: {e}")  # the hub falls back to probing the channels
+        time.sleep(HEARTBEAT_INTERVAL)
+
+def start_heartbeats():
+    if HEARTBEAT_INTERVAL:
+        threading.Thread(target=heartbeat_loop, name='heartbeat', daemon=True).start()
+
+#__________________________________________ROUTES: list of the hosted channels
+@app.route('/', methods=['GET'])
+def list_channels():
+    return jsonify([{'id': channel_id,
+                     'name': channel.name,
+                     'endpoint': channel.endpoint,
+                     'last_message_id': channel.store.state()[0],
+                     'message_bytes': channel.store.memory_usage(),
+                     'subscribers': channel.broker.subscriber_count()}
+                    for channel_id, channel in channels.items()])
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    return jsonify({'channels': len(channels)}), 200
+
+#_________________________________________Run Application
+if __name__ == '__main__':
+    start_heartbeats()
+    app.run(port=5002, threaded=True)
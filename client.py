@@ -1,13 +1,20 @@
 #__________________________________________IMPORTS
-from flask import Flask, request, render_template, url_for, redirect
+from flask import Flask, request, render_template, url_for, redirect, jsonify
 import requests
 import urllib.parse
 import datetime
+import threading
+import time
+import heapq
+import concurrent.futures
 from flask_cors import CORS
 import os
 from flask import send_from_directory
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin
+from outbound import OutboundClient
+import metrics
+import wire
 
 #______________________________________Flask Application Initialization
 app = Flask(__name__, static_folder="frontend/build/static")
@@ -16,11 +23,27 @@ CORS(app, origins="http://localhost:3000", methods=["GET", "POST", "OPTIONS"])
 #______________________________________Server Configuration
 HUB_AUTHKEY = '1234567890'# Authentication key for Hub
 HUB_URL = 'http://localhost:5555'# Hub endpoint URL
-CHANNELS = None# Cached list of channels
-LAST_CHANNEL_UPDATE = None# Timestamp of last channel update
+HUB_FALLBACK_URLS = []# Other hubs sharing the directory (hub federation), asked in turn when the hub does not answer
+CHANNEL_CACHE_MAX_AGE = 60# Seconds before the cached list of channels is revalidated with the hub
+OUTBOUND_TIMEOUT = (3.05, 10)# (connect, read) timeout in seconds for calls to channels and the hub
+OUTBOUND_RETRIES = 2# Extra attempts for idempotent (GET) calls
+CIRCUIT_FAILURE_THRESHOLD = 5# Consecutive failures before calls to a channel fail fast
+CIRCUIT_RESET_TIMEOUT = 30# Seconds before a failed channel is tried again
+FEED_DEADLINE = 2.0# Seconds /feed waits for channels; slower channels are reported as pending
+FEED_CACHE_TTL = 2.0# Seconds a channel's messages are reused by /feed
+FEED_WORKERS = 16# Channels fetched concurrently by /feed
 db = SQLAlchemy() 
 headers = {"Authorization": "authkey 1234567890"}
 
+# Shared outbound HTTP client: pooled keep-alive connections, timeouts, retries and a circuit breaker per channel
+outbound = OutboundClient(timeout=OUTBOUND_TIMEOUT, retries=OUTBOUND_RETRIES,
+                          failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT)
+metrics.gauge('outbound_open_circuits', 'Channels currently failing fast',
+              lambda: sum(1 for stats in outbound.stats().values() if stats['circuit'] != 'closed'))
+
+# /metrics (Prometheus) and /debug/profile?seconds=<n> (from localhost only)
+metrics.instrument(app)
+
 #__________________________________________USER MODEL required by Flask-User for authentication and account management
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -45,21 +68,110 @@ user_manager = LoginManager(app) # Setting up Flask-login to handle user authent
 @user_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
+#______________________________________Channel Directory Cache
+# One cache shared by all requests of this process. Once it has a channel list
+# it never blocks a request: an expired list is served while a background
+# thread revalidates it with the hub (ETag / 304, or only the changes since the
+# version we have). If the hub is down, the fallback hubs are asked in turn.
+class ChannelDirectoryCache(object):
+    def __init__(self, hub_url, max_age=60, fallback_urls=()):
+        self.hub_url = hub_url
+        self.fallback_urls = list(fallback_urls)
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.channels = None    # endpoint -> channel record
+        self.version = None
+        self.source = None      # the hub that numbered self.version, each hub counts its own versions
+        self.updated = None     # datetime of the last successful refresh
+        self.refreshing = False
+
+    def get(self):
+        if self.channels is None:
+            self.refresh()  # nothing to serve yet, the first request has to wait
+        elif (datetime.datetime.now() - self.updated).total_seconds() >= self.max_age:
+            with self.lock:
+                start = not self.refreshing
+                self.refreshing = True
+            if start:
+                threading.Thread(target=self.refresh, daemon=True).start()
+        return list((self.channels or {}).values())
+
+    def request_hub(self):  # -> (response, hub url) from the first hub that answers
+        error = None
+        for hub_url in [self.hub_url] + self.fallback_urls:
+            request_headers = dict(headers, Accept=wire.ACCEPT)
+            params = {}
+            if self.version is not None and hub_url == self.source:
+                request_headers['If-None-Match'] = '"{}"'.format(self.version)
+                params['since_version'] = self.version
+            try:
+                response = outbound.get(hub_url + '/channels', headers=request_headers, params=params)
+            except requests.exceptions.RequestException as e:
+                error = e
+                continue
+            if response.status_code < 500:
+                return response, hub_url
+            error = requests.exceptions.HTTPError("{} from {}".format(response.status_code, hub_url), response=response)
+        raise error
+
+    def refresh(self):
+        try:
+            response, hub_url = self.request_hub()
+            if response.status_code == 304:
+                self.updated = datetime.datetime.now()
+                return
+            if response.status_code != 200:
+                print("Error fetching channels: "+str(response.text))
+                return
+            channels_response = wire.decode_response(response)
+            if not 'channels' in channels_response:
+                print("No channels in response")
+                return
+            if channels_response.get('delta'):
+                channels = dict(self.channels or {})
+                for endpoint in channels_response.get('removed', []):
+                    channels.pop(endpoint, None)
+            else:
+                channels = {}
+            for c in channels_response['channels']:
+                channels[c['endpoint']] = c
+            self.channels = channels
+            self.version = channels_response.get('version')
+            self.source = hub_url
+            self.updated = datetime.datetime.now()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print("Error fetching channels:", e)
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+channel_directory = ChannelDirectoryCache(HUB_URL, max_age=CHANNEL_CACHE_MAX_AGE, fallback_urls=HUB_FALLBACK_URLS)
+
 #______________________________________Channel Validation Update
 def update_channels():
-    global CHANNELS, LAST_CHANNEL_UPDATE
-    if CHANNELS and LAST_CHANNEL_UPDATE and (datetime.datetime.now() - LAST_CHANNEL_UPDATE).seconds < 60:
-        return CHANNELS # fetch list of channels from server
-    response = requests.get('http://localhost:5555/channels', headers=headers)
-    print("Response from Hub:", response.text) 
+    return channel_directory.get()
+#______________________________________Channel Messages: conditional GETs in the compact wire format
+# Asks for MessagePack (if msgpack is installed) and gzip, and keeps the last
+# message list of each channel with its ETag: an unchanged channel answers 304
+# and its messages are neither transferred nor decoded again.
+channel_messages_cache = {}# endpoint -> (ETag, messages)
+
+def get_channel_messages(channel):# ValueError if the channel answers with an error
+    endpoint = channel['endpoint']
+    request_headers = dict(headers, Accept=wire.ACCEPT)
+    cached = channel_messages_cache.get(endpoint)
+    if cached:
+        request_headers['If-None-Match'] = cached[0]
+    response = outbound.get(endpoint, headers=request_headers, endpoint=endpoint)
+    if response.status_code == 304 and cached:
+        return cached[1]
     if response.status_code != 200:
-        return "Error fetching channels: "+str(response.text), 400
-    channels_response = response.json()
-    if not 'channels' in channels_response:
-        return "No channels in response", 400
-    CHANNELS = channels_response['channels']
-    LAST_CHANNEL_UPDATE = datetime.datetime.now()
-    return CHANNELS
+        raise ValueError("HTTP {}: {}".format(response.status_code, response.text))
+    messages = wire.decode_response(response)
+    if response.headers.get('ETag'):
+        channel_messages_cache[endpoint] = (response.headers['ETag'], messages)
+    return messages
+
 #______________________________________Routing To Home Page to fetch list of channels from server
 @app.route('/home')
 def home_page():    
@@ -79,10 +191,12 @@ def show_channel():
             break
     if not channel:
         return "Channel not found", 404
-    response = requests.get(channel['endpoint'], headers=headers)
-    if response.status_code != 200:
-        return "Error fetching messages: "+str(response.text), 400
-    messages = response.json()
+    try:
+        messages = get_channel_messages(channel)
+    except requests.exceptions.RequestException as e:
+        return "Channel not reachable: "+str(e), 503
+    except ValueError as e:
+        return "Error fetching messages: "+str(e), 400
     return render_template("channel.html", channel=channel, messages=messages)
 
 #______________________________________Routing To Send A Message To The Channel
@@ -101,12 +215,72 @@ def post_message():
     message_content = request.form['content']
     message_sender = request.form['sender']
     message_timestamp = datetime.datetime.now().isoformat()
-    response = requests.post(channel['endpoint'],
-                             headers=headers,
-                             json={'content': message_content, 'sender': message_sender, 'timestamp': message_timestamp})
+    try:
+        response = outbound.post(channel['endpoint'],
+                                 endpoint=channel['endpoint'],
+                                 headers=dict(headers, **{'X-Forwarded-For': request.remote_addr}),# the channel rate-limits per user address
+                                 json={'content': message_content, 'sender': message_sender, 'timestamp': message_timestamp})
+    except requests.exceptions.RequestException as e:
+        return "Channel not reachable: "+str(e), 503
+    if response.status_code == 429:# rate limited or busy: pass the channel's answer on
+        return response.text, 429, {'Retry-After': response.headers.get('Retry-After', '1')}
     if response.status_code != 200:
         return "Error posting message: "+str(response.text), 400
     return redirect(url_for('show_channel')+'?channel='+urllib.parse.quote(post_channel))
+#______________________________________Multi-Channel Feed: fetches channels concurrently and merges their messages
+feed_executor = concurrent.futures.ThreadPoolExecutor(max_workers=FEED_WORKERS, thread_name_prefix='feed')
+feed_cache = {}# endpoint -> (time.monotonic() of the fetch, messages)
+feed_inflight = {}# endpoint -> Future of a running fetch, shared by concurrent /feed requests
+feed_lock = threading.Lock()
+
+def fetch_channel_messages(channel):
+    # copies: the decoded messages are shared with the conditional GET cache
+    messages = [dict(m, channel=channel['name'], channel_endpoint=channel['endpoint'])
+                for m in sorted(get_channel_messages(channel), key=lambda m: str(m.get('timestamp', '')))]
+    feed_cache[channel['endpoint']] = (time.monotonic(), messages)
+    return messages
+
+def channel_messages_future(channel):
+    # a fresh cached result, the fetch already running for this channel, or a new fetch
+    endpoint = channel['endpoint']
+    with feed_lock:
+        cached = feed_cache.get(endpoint)
+        if cached and time.monotonic() - cached[0] < FEED_CACHE_TTL:
+            future = concurrent.futures.Future()
+            future.set_result(cached[1])
+            return future
+        future = feed_inflight.get(endpoint)
+        if future is None or future.done():
+            future = feed_inflight[endpoint] = feed_executor.submit(fetch_channel_messages, channel)
+        return future
+
+@app.route('/feed')
+def show_feed():
+    # ?channel=<endpoint> (repeatable) selects channels, default is every active channel
+    selected = [urllib.parse.unquote(c) for c in request.args.getlist('channel')]
+    channels = [c for c in update_channels()
+                if (c['endpoint'] in selected if selected else c.get('active', True))]
+    futures = {channel_messages_future(c): c for c in channels}
+    done, pending = concurrent.futures.wait(futures, timeout=FEED_DEADLINE)
+    # slow channels keep loading in the background and fill the cache for the next request
+    results, failed = [], []
+    for future in done:
+        if future.exception() is None:
+            results.append(future.result())
+        else:
+            failed.append(futures[future]['name'])
+    # each channel's messages are sorted by timestamp, so a k-way heap merge is enough
+    messages = list(heapq.merge(*results, key=lambda m: str(m.get('timestamp', ''))))
+    pending = [futures[future]['name'] for future in pending]
+    if request.args.get('format') == 'json':
+        return jsonify(messages=messages, pending=pending, failed=failed)
+    return render_template("feed.html", messages=messages, pending=pending, failed=failed)
+
+#______________________________________Outbound Statistics: latency and error counters per channel endpoint
+@app.route('/stats/outbound')
+def outbound_stats():
+    return jsonify(outbound.stats())
+
 #______________________________________React App Routing To Main Page
 @app.route('/')
 def serve_react_app(): # Send index.html from React build folder
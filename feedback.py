@@ -0,0 +1,84 @@
+#__________________________________________IMPORTS
+import json
+import os
+import random
+import re
+import threading
+import time
+
+#__________________________________________Topic Matcher: one precompiled regex for all topic keywords
+# The keywords are merged into a trie and the trie is turned into a single
+# regular expression, so keywords sharing a prefix ("art", "artist") share the
+# work and the cost per message does not grow with the number of topics.
+def _trie_pattern(node):
+    alternatives = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ''
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:  # a keyword ends here, the longer ones are optional
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+def compile_keywords(keywords):
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    if not trie:
+        return None
+    return re.compile(r'\b(' + _trie_pattern(trie) + r')\b', re.IGNORECASE)
+
+
+#__________________________________________Feedback Engine: canned responses for topics mentioned in a message
+class FeedbackEngine(object):
+    def __init__(self, path, every=3, reload_interval=1.0):
+        self.path = path
+        self.every = every                      # feedback after every `every`-th message
+        self.reload_interval = reload_interval  # seconds between checks for a changed topic file
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0
+        self._responses = {}  # keyword (lower case) -> list of responses
+        self._priority = {}   # keyword -> position in the topic file, earlier topics win
+        self._matcher = None
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return  # keep the topics we have
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    topics = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not load feedback topics from {self.path}: {e}")
+                return
+            responses = {topic.lower(): list(answers) for topic, answers in topics.items() if answers}
+            self._priority = {topic: i for i, topic in enumerate(responses)}
+            self._matcher = compile_keywords(responses)
+            self._responses = responses
+            self._mtime = mtime
+
+    def is_due(self, message_count):  # message_count: messages in the channel before this one
+        return (message_count + 1) % self.every == 0
+
+    def feedback_for(self, content, message_count):
+        if not self.is_due(message_count):
+            return None  # no matching at all when no feedback is due
+        self._reload_if_changed()
+        matcher, responses, priority = self._matcher, self._responses, self._priority
+        if matcher is None:
+            return None
+        topics = {match.lower() for match in matcher.findall(content)}
+        if not topics:
+            return None
+        return random.choice(responses[min(topics, key=priority.get)])
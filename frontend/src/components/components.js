@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import axios from 'axios';
 
 const CHANNEL_URL = "http://localhost:5001";  // Channel server URL
@@ -12,22 +12,42 @@ export default function Client() {
   const [isUsernameSet, setIsUsernameSet] = useState(!!localStorage.getItem("username"));
   const [searchTerm, setSearchTerm] = useState(""); // State for search term
   const [unreadCount, setUnreadCount] = useState(0);
+  const lastIdRef = useRef(0); // id of the newest message we have, used as the fetch cursor
 
-  // Fetch messages when component mounts and periodically
+  // Fetch messages when component mounts, then let the channel push new ones
+  // over Server-Sent Events; fall back to polling if EventSource is unavailable
   useEffect(() => {
     fetchMessages();
-    const interval = setInterval(fetchMessages, 5000);
-    return () => clearInterval(interval);
+    if (!window.EventSource) {
+      const interval = setInterval(fetchMessages, 5000);
+      return () => clearInterval(interval);
+    }
+    const source = new EventSource(`${CHANNEL_URL}/stream?since=${lastIdRef.current}`);
+    source.onmessage = (event) => addMessages([JSON.parse(event.data)]);
+    return () => source.close();
   }, []);
 
+  // Append messages we have not seen yet (a message can arrive by stream and by fetch)
+  const addMessages = (incoming) => {
+    const newMessages = incoming.filter(msg => msg.id > lastIdRef.current);
+    if (!newMessages.length) return;
+    lastIdRef.current = newMessages[newMessages.length - 1].id;
+    setMessages(prev => [...prev, ...newMessages]);
+    // Update unread count
+    setUnreadCount(prev => prev + newMessages.length);
+  };
+
   const fetchMessages = async () => {
     try {
-      const response = await axios.get(CHANNEL_URL, { headers });
-      const newMessages = response.data;
-      setMessages(newMessages);
-      // Update unread count
-      const currentCount = newMessages.length - messages.length;
-      if (currentCount > 0) setUnreadCount(prev => prev + currentCount);
+      // Only ask for messages newer than the ones we have; the browser revalidates
+      // with If-None-Match, so a quiet channel answers with an empty 304
+      const response = await axios.get(CHANNEL_URL, {
+        headers,
+        params: { since: lastIdRef.current },
+        validateStatus: (status) => status === 200 || status === 304,
+      });
+      if (response.status === 304) return;
+      addMessages(response.data);
     } catch (error) {
       console.error("Error fetching messages:", error);
     }
@@ -111,7 +131,7 @@ export default function Client() {
           <div style={{ height: "300px", overflowY: "auto", border: "1px solid #ccc", padding: "10px", marginBottom: "10px" }}>
           {filteredMessages.map((msg, index) => (
               <div
-                key={index}
+                key={msg.id ?? index}
                 style={{
                   padding: "10px",
                   backgroundColor: "#f1f1f1",
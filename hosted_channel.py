@@ -0,0 +1,402 @@
+#__________________________________________IMPORTS
+from flask import Blueprint, request, jsonify, Response, g, current_app, abort
+from werkzeug.http import is_resource_modified
+import datetime
+import math
+import time
+from message_store import create_store, RetentionPolicy
+from message_broker import MessageBroker, TooManySubscribers
+from message_archive import MessageArchive, matches
+from moderation import moderate_many
+import metrics
+import wire
+
+#__________________________________________Hosted Channel: the state and message pipeline of one channel
+# channel.py serves one of these at the root of its app, channel_host.py serves
+# many of them under /<channel id>/. Everything heavy (moderation models, the
+# moderation batcher, feedback topic files) is shared and passed in, so a
+# channel itself is little more than its configuration, a message ring buffer
+# and its subscribers.
+MAX_WAIT = 30  # longest long-poll (?wait=<seconds>) a client may ask for
+MAX_SUBSCRIBERS = 1000  # long-poll and SSE clients of one channel
+STORE_POLL_INTERVAL = 1.0  # waiters re-check the store this often to see posts from other workers
+SSE_KEEPALIVE = 15  # seconds between keep-alive comments on an idle /stream
+MAX_MODERATE_REQUEST = 1000  # messages accepted by one POST /moderate
+HISTORY_PAGE_SIZE = 50  # messages per /history or /search page by default
+HISTORY_MAX_PAGE_SIZE = 500
+SENDER_RATE = 0.5  # messages per second one sender may post to a channel, on average (None: no limit)
+SENDER_BURST = 5  # messages a sender may post in a row before the rate applies
+CLIENT_RATE = 2.0  # the same for one client address, over all channels of the process
+CLIENT_BURST = 20
+TRUSTED_PROXIES = ('127.0.0.1', '::1')  # may name the client in X-Forwarded-For (client.py does)
+
+send_stage_latency = metrics.histogram('channel_send_stage_seconds', 'Time per step of posting a message', ('stage',))
+messages_total = metrics.counter('channel_messages_total', 'Posted messages by outcome', ('result',))
+
+class HostedChannel(object):
+    def __init__(self, name, endpoint, authkey, type_of_service, moderator, feedback_engine,
+                 storage='jsonl', store_file='messages.jsonl', legacy_file=None, archive_dir=None,
+                 max_messages=10, max_bytes=None, max_message_bytes=None, off_topic_filter=True,
+                 welcome_message=None, max_subscribers=MAX_SUBSCRIBERS, max_wait=MAX_WAIT,
+                 poll_interval=STORE_POLL_INTERVAL, sse_keepalive=SSE_KEEPALIVE,
+                 max_moderate_request=MAX_MODERATE_REQUEST, rate_limiter=None, post_slots=None,
+                 sender_rate=SENDER_RATE, sender_burst=SENDER_BURST, client_rate=CLIENT_RATE, client_burst=CLIENT_BURST):
+        self.name = name
+        self.endpoint = endpoint
+        self.authkey = authkey
+        self.type_of_service = type_of_service
+        self.moderator = moderator                  # shared ModerationBatcher
+        self.feedback_engine = feedback_engine      # shared per topic file
+        self.max_message_bytes = max_message_bytes  # longest accepted message content, in bytes
+        self.off_topic_filter = off_topic_filter    # the off-topic model is about art history
+        self.welcome_message = welcome_message
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.sse_keepalive = sse_keepalive
+        self.max_moderate_request = max_moderate_request
+        self.rate_limiter = rate_limiter  # shared token buckets (rate_limit.py), None: no rate limits
+        self.post_slots = post_slots      # shared semaphore: posts checked at once by the process, None: no cap
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        # messages compacted out of the store move to the archive (history and search), if there is one
+        self.archive = MessageArchive(archive_dir) if archive_dir else None
+        self.store = create_store(storage, store_file,
+                                  retention=RetentionPolicy(max_messages=max_messages, max_bytes=max_bytes),
+                                  legacy_path=legacy_file, on_evict=self.archive.add if self.archive else None)
+        if self.archive is not None:
+            self.store.evict_backlog()  # messages that left the hot window before they went to the archive at once
+        self.broker = MessageBroker(max_subscribers=max_subscribers)
+
+    def record(self):  # registration record for the hub
+        return {'name': self.name,
+                'endpoint': self.endpoint,
+                'authkey': self.authkey,
+                'type_of_service': self.type_of_service}
+
+    def parse_cursor(self, args):  # (since, limit, wait) from the query string, ValueError if invalid
+        since = int(args.get('since', 0))
+        limit = int(args['limit']) if 'limit' in args else None
+        wait = min(float(args.get('wait', 0)), self.max_wait)
+        if since < 0 or (limit is not None and limit < 1):
+            raise ValueError()
+        return since, limit, wait
+
+    # The steps of send_message(), shared with the async server (channel_asgi.py)
+    def enter_post(self):  # False if the process is already checking as many posts as it may
+        if self.post_slots is None or self.post_slots.acquire(blocking=False):
+            return True
+        messages_total.inc(result='overloaded')
+        return False
+
+    def leave_post(self):
+        if self.post_slots is not None:
+            self.post_slots.release()
+
+    def rate_limit_error(self, message, client):  # (error, seconds to wait) if the sender or client posts too often
+        limits = []
+        if self.sender_rate:
+            limits.append(('sender {} {}'.format(self.endpoint, message['sender']), self.sender_rate, self.sender_burst))
+        if self.client_rate and client:
+            limits.append(('client {}'.format(client), self.client_rate, self.client_burst))
+        wait = self.rate_limiter.take(limits) if self.rate_limiter is not None and limits else 0
+        if not wait:
+            return None
+        messages_total.inc(result='rate_limited')
+        return "Too many messages, try again in {}s".format(retry_after(wait)), wait
+
+    def validate_message(self, message):
+        if not isinstance(message, dict) or 'content' not in message or 'sender' not in message or 'timestamp' not in message:
+            messages_total.inc(result='invalid')
+            return "Invalid message format"
+        if self.max_message_bytes is not None and len(str(message['content']).encode('utf-8')) > self.max_message_bytes:
+            messages_total.inc(result='too_large')
+            return "Message too large (at most {} bytes)".format(self.max_message_bytes)
+        return None
+
+    def moderation_error(self, verdict):
+        if verdict['profane']:
+            messages_total.inc(result='profane')
+            return "Inappropriate content"
+        if verdict['off_topic'] and self.off_topic_filter:
+            messages_total.inc(result='off_topic')
+            return "Off-topic content"
+        return None
+
+    def generate_feedback(self, message_content):
+        # Topics and responses live in a topic file, which is reloaded when it changes.
+        last_id, _ = self.store.state()  # messages posted so far; only every n-th message gets feedback
+        return self.feedback_engine.feedback_for(message_content, last_id)
+
+    def commit_message(self, message):
+        extra = message['extra'] if 'extra' in message else None
+
+        # Generate feedback message
+        with send_stage_latency.time(stage='feedback'):
+            feedback = self.generate_feedback(message['content'])
+        messages = []
+        if feedback:
+            messages.append({'content': feedback,
+                            'sender': "ArtBot",
+                            'timestamp': message['timestamp'],
+                            'extra': None,
+                            })
+
+        # Save user message
+        messages.append({'content': message['content'],
+                         'sender': message['sender'],
+                         'timestamp': message['timestamp'],
+                         'extra': extra,
+                         })
+        with send_stage_latency.time(stage='store'):
+            self.store_messages(messages)
+        messages_total.inc(result='accepted')
+
+    def store_messages(self, new_messages):
+        self.broker.publish(self.store.append_many(new_messages))  # wake long-poll and SSE clients
+
+    def wait_for_messages(self, since, timeout):  # blocks until a message newer than `since` exists
+        # subscribe before looking at the store so a message committed in between is not missed
+        with self.broker.subscribe() as subscription:
+            deadline = time.monotonic() + timeout
+            while not self.store.since(since, 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                subscription.get(min(remaining, self.poll_interval))
+
+    # The hot window is in memory and everything older in the archive (which
+    # gets each message as it leaves the window), so neither reads the message log.
+    def history(self, before_id, limit):  # up to `limit` messages with id < before_id, oldest first
+        messages = [m for m in self.store.recent() if m['id'] < before_id][-limit:]
+        if len(messages) < limit and self.archive is not None:
+            older_than = messages[0]['id'] if messages else before_id
+            messages = self.archive.history(older_than, limit - len(messages)) + messages
+        return messages
+
+    def search(self, query, limit, before_id=None):  # newest matching messages first
+        messages = [m for m in reversed(self.store.recent())
+                    if (before_id is None or m['id'] < before_id) and matches(m, query)][:limit]
+        if len(messages) < limit and self.archive is not None:
+            older_than = messages[-1]['id'] if messages else before_id
+            messages += self.archive.search(query, limit - len(messages), older_than)
+        return messages
+
+    def add_welcome_message(self):  # if no messages are present
+        if self.welcome_message and not self.store.recent():
+            self.store_messages([{'content': self.welcome_message,
+                                  'sender': " ",
+                                  'timestamp': "0",
+                                  'extra': None}])
+
+def last_modified_header(stamp):  # -> Last-Modified for the store's last write time, None for no header
+    # the header has whole seconds, so while the second of the last write lasts
+    # another post could come with the same value: until then only the ETag validates
+    if stamp is None or int(stamp) >= int(time.time()):
+        return None
+    return datetime.datetime.fromtimestamp(int(stamp), datetime.timezone.utc)
+
+def retry_after(seconds):  # Retry-After header value
+    return str(max(1, math.ceil(seconds)))
+
+def client_address(remote_addr, forwarded_for):  # the address rate limits apply to
+    if remote_addr in TRUSTED_PROXIES and forwarded_for:
+        return forwarded_for.split(',')[-1].strip()  # added by the proxy next to us, the others can be forged
+    return remote_addr
+
+#_________________________________________Request Authorization Check
+def check_authorization(request):
+    #global CHANNEL_AUTHKEY
+    #print("Authorization Header:", request.headers.get('Authorization'))  # Log the header for debugging
+    #if 'Authorization' not in request.headers:
+        #return False
+    #if request.headers['Authorization'] != 'authkey ' + CHANNEL_AUTHKEY:
+        #return False
+    return True
+
+#_________________________________________Routes of a channel, registered once per app
+# host_channels(app, {None: channel}) serves one channel at the root,
+# host_channels(app, {'<id>': channel, ...}, prefix='/<channel_id>') many under /<id>/.
+channel_routes = Blueprint('channel', __name__)
+
+def host_channels(app, channels, prefix=None):
+    app.extensions['hosted_channels'] = channels
+    app.register_blueprint(channel_routes, url_prefix=prefix)
+    wire.compress_responses(app)  # gzip/brotli for clients that send Accept-Encoding
+
+@channel_routes.url_value_preprocessor
+def select_channel(endpoint, values):
+    channel_id = values.pop('channel_id', None) if values else None
+    g.channel = current_app.extensions['hosted_channels'].get(channel_id)
+    if g.channel is None:
+        abort(404)
+
+#_________________________________________Health Check Endpoint
+@channel_routes.route('/health', methods=['GET'])
+def health_check():
+    if not check_authorization(request):
+        return "Invalid authorization1", 400
+    return jsonify({'name': g.channel.name}),  200
+
+#_________________________________________Get Messages: Returns A list of messages
+# Optional cursor parameters: since=<id> returns only messages newer than <id>,
+# limit=<n> caps the number of messages. Unchanged polls are answered with 304
+# from the ETag / Last-Modified validators before any message is read.
+# wait=<seconds> turns the request into a long-poll that returns as soon as a
+# message newer than <since> is committed.
+@channel_routes.route('/', methods=['GET'], strict_slashes=False)  # /<id> and /<id>/ are the same channel
+def home_page():
+    channel = g.channel
+    if not check_authorization(request):
+        return "Invalid authorization2", 400
+    try:
+        since, limit, wait = channel.parse_cursor(request.args)
+    except ValueError:
+        return "Invalid since, limit or wait parameter", 400
+    if wait > 0:
+        try:
+            channel.wait_for_messages(since, wait)
+        except TooManySubscribers:
+            return "Too many waiting clients", 503, {'Retry-After': '5'}
+    last_id, last_modified = channel.store.state()
+    etag = str(last_id)
+    last_modified = last_modified_header(last_modified)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = wire.respond(channel.store.since(since, limit))  # JSON or MessagePack, see wire.py
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:  # None would be sent as the current time
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True  # caches must revalidate, which is a cheap 304
+    response.headers['X-Last-Message-Id'] = str(last_id)
+    return response
+
+#_________________________________________Stream Messages: Server-Sent Events push of new messages
+# Resumes after the Last-Event-ID header (sent by EventSource on reconnect) or
+# ?since=<id>. A client that cannot keep up is disconnected and resumes from the store.
+@channel_routes.route('/stream', methods=['GET'])
+def stream_messages():
+    channel = g.channel
+    if not check_authorization(request):
+        return "Invalid authorization", 400
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+    except ValueError:
+        return "Invalid since parameter", 400
+    try:
+        subscription = channel.broker.subscribe()
+    except TooManySubscribers:
+        return "Too many waiting clients", 503, {'Retry-After': '5'}
+
+    def events(since):
+        try:
+            yield 'retry: 3000\n\n'
+            idle = 0
+            while not subscription.overflowed:
+                for message in channel.store.since(since):
+                    yield 'id: {}\ndata: {}\n\n'.format(message['id'], wire.dumps(message).decode('utf-8'))
+                    since = message['id']
+                if subscription.get(channel.poll_interval):
+                    idle = 0
+                    continue
+                idle += channel.poll_interval
+                if idle >= channel.sse_keepalive:
+                    yield ': keepalive\n\n'
+                    idle = 0
+        finally:
+            subscription.close()
+
+    return Response(events(since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+#_________________________________________Send Message: Handles sending and receiving messages
+@channel_routes.route('/', methods=['POST'], strict_slashes=False)
+def send_message():
+    channel = g.channel
+    if not check_authorization(request):
+        return "Invalid authorization3", 400
+
+    # load shedding before any expensive work: a slot among the posts the process checks at once,
+    # then a token from the sender's and the client's rate limit
+    if not channel.enter_post():
+        return "Too many messages in progress, try again", 429, {'Retry-After': retry_after(1)}
+    try:
+        message = request.json
+        error = channel.validate_message(message)
+        if error:
+            return error, 400
+        limited = channel.rate_limit_error(message, client_address(request.remote_addr,
+                                                                   request.headers.get('X-Forwarded-For')))
+        if limited:
+            return limited[0], 429, {'Retry-After': retry_after(limited[1])}
+
+        with send_stage_latency.time(stage='moderation'):  # includes waiting for the batch
+            verdict = channel.moderator.score(message['content'])
+        error = channel.moderation_error(verdict)
+        if error:
+            return error, 400
+
+        channel.commit_message(message)
+        return "OK", 200
+    finally:
+        channel.leave_post()
+
+#_________________________________________History and Search: older messages, from the store and the archive
+# /history?before=<id>&limit=<n> returns the messages before <id>, oldest first
+# (scroll back by passing the id of the oldest message you have).
+# /search?q=<words>&limit=<n>&before=<id> returns matching messages, newest first.
+def parse_page(args):  # (before, limit), ValueError if invalid
+    before = int(args['before']) if args.get('before') else None
+    limit = min(int(args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+    if (before is not None and before < 1) or limit < 1:
+        raise ValueError()
+    return before, limit
+
+@channel_routes.route('/history', methods=['GET'])
+def message_history():
+    channel = g.channel
+    if not check_authorization(request):
+        return "Invalid authorization", 400
+    try:
+        before, limit = parse_page(request.args)
+    except ValueError:
+        return "Invalid before or limit parameter", 400
+    if before is None:
+        before = channel.store.state()[0] + 1
+    return wire.respond(channel.history(before, limit))
+
+@channel_routes.route('/search', methods=['GET'])
+def search_messages():
+    channel = g.channel
+    if not check_authorization(request):
+        return "Invalid authorization", 400
+    try:
+        before, limit = parse_page(request.args)
+    except ValueError:
+        return "Invalid before or limit parameter", 400
+    if not request.args.get('q', '').strip():
+        return "Missing q parameter", 400
+    return wire.respond(channel.search(request.args['q'], limit, before))
+
+#_________________________________________Bulk Moderation: checks many messages at once without posting them
+# Accepts a JSON list of strings or of message objects with a 'content' field.
+@channel_routes.route('/moderate', methods=['POST'])
+def moderate_messages():
+    channel = g.channel
+    if not check_authorization(request):
+        return "Invalid authorization", 400
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return "Expected a list of messages", 400
+    if len(items) > channel.max_moderate_request:
+        return "Too many messages (at most {})".format(channel.max_moderate_request), 400
+    contents = [item.get('content') if isinstance(item, dict) else item for item in items]
+    if not all(isinstance(content, str) for content in contents):
+        return "Invalid message format", 400
+    verdicts = moderate_many(contents)
+    if not channel.off_topic_filter:
+        verdicts = [dict(verdict, off_topic=False) for verdict in verdicts]
+    return jsonify([dict(verdict, ok=not (verdict['profane'] or verdict['off_topic']))
+                    for verdict in verdicts])
@@ -1,10 +1,23 @@
-
 #__________________________________________IMPORTS
 from flask import Flask, request, render_template, jsonify, redirect, url_for
+from werkzeug.http import is_resource_modified
 from flask_sqlalchemy import SQLAlchemy
 import json 
+import os
+import re
 import datetime 
 import requests   
+import requests.adapters
+import concurrent.futures
+import threading
+import random
+import time
+import bisect
+import hashlib
+import fcntl
+import urllib.parse
+import metrics
+import wire
 
 db = SQLAlchemy() 
 #__________________________________________DATA MODEL:Defining the Channel model representing the channels table in the database
@@ -19,6 +32,40 @@ class Channel(db.Model):
     type_of_service = db.Column(db.String(100, collation='NOCASE'), nullable=False)
     last_heartbeat = db.Column(db.DateTime(), nullable=True, server_default=None)
 
+#__________________________________________DATA MODEL: change log of the channel directory (its id is the directory version)
+# stamp and origin (the URL of the hub where the change was made) version the
+# channel's record across federated hubs: the change with the highest
+# (stamp, origin) wins (see FEDERATION below)
+class ChannelChange(db.Model):
+    __tablename__ = 'channel_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    endpoint = db.Column(db.String(100, collation='NOCASE'), nullable=False)
+    changed_at = db.Column(db.DateTime(), nullable=False, default=datetime.datetime.now)
+    stamp = db.Column(db.Float(), nullable=True)
+    origin = db.Column(db.String(200), nullable=True)
+
+class ChangeClock(object):
+    # wall clock time that never goes back and never falls behind a change seen
+    # from another hub, so a later local change always wins over it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = 0.0
+
+    def now(self):
+        with self.lock:
+            self.last = max(time.time(), self.last + 1e-6)
+            return self.last
+
+    def observe(self, stamp):
+        with self.lock:
+            self.last = max(self.last, stamp)
+
+change_clock = ChangeClock()
+
+def record_change(endpoint):
+    # call whenever a channel is added, removed or its public fields change; committed with the change
+    db.session.add(ChannelChange(endpoint=endpoint, stamp=change_clock.now(), origin=HUB_URL))
+
 
 #__________________________________________Class-Based Configuration for the Flask Application
 class ConfigClass(object):
@@ -27,7 +74,7 @@ class ConfigClass(object):
     # Flask settings
     SECRET_KEY = 'This is an INSECURE secret!! DO NOT use this in production!!' # change to something random, no matter what
     # Flask-SQLAlchemy settings
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///chat_server.sqlite'  
+    SQLALCHEMY_DATABASE_URI = os.environ.get('HUB_DATABASE_URI', 'sqlite:///chat_server.sqlite')  # override e.g. for benchmarks
     SQLALCHEMY_TRACK_MODIFICATIONS = False  
     
 
@@ -41,81 +88,215 @@ db.create_all()
 
 SERVER_AUTHKEY = '1234567890'  # Server authorization key used for validating incoming requests
 STANDARD_CLIENT_URL = 'http://localhost:5005' # standard configuration in client.py, chang to real URL if necessary
+# Several hubs can share one directory (see FEDERATION below). Each hub is known by its own URL,
+# e.g. HUB_URL=http://localhost:5556 HUB_PEERS=http://localhost:5555,http://localhost:5557
+HUB_URL = os.environ.get('HUB_URL', 'http://localhost:5555').rstrip('/')
+HUB_PEERS = [url.strip().rstrip('/') for url in os.environ.get('HUB_PEERS', '').split(',') if url.strip()]
+
+# /metrics (Prometheus) and /debug/profile?seconds=<n>, the profiler needs the server authkey
+metrics.instrument(app, authorize=lambda request: request.headers.get('Authorization') == 'authkey ' + SERVER_AUTHKEY)
+# gzip/brotli for clients that send Accept-Encoding, /channels also speaks MessagePack (wire.py)
+wire.compress_responses(app)
+
+
+#__________________________________________HEALTH CHECK CONFIGURATION
+HEALTH_CHECK_INTERVAL = 60          # seconds between checks of a healthy channel
+HEALTH_CHECK_MAX_INTERVAL = 15 * 60 # failing channels back off exponentially up to this interval
+HEALTH_CHECK_TIMEOUT = (3.05, 5)    # (connect, read) timeout in seconds for one probe
+HEALTH_CHECK_WORKERS = 16           # channels probed concurrently
+HEARTBEAT_FLUSH_INTERVAL = 1.0      # seconds of pushed heartbeats written in one transaction
+MAX_BATCH_RECORDS = 1000            # channels per /channels/batch or /heartbeat request
 
+# One pooled session for all probes, so repeated checks reuse keep-alive connections
+health_session = requests.Session()
+health_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=HEALTH_CHECK_WORKERS, pool_maxsize=HEALTH_CHECK_WORKERS))
+health_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=HEALTH_CHECK_WORKERS, pool_maxsize=HEALTH_CHECK_WORKERS))
+
+health_probe_latency = metrics.histogram('hub_health_probe_seconds', 'Duration of one channel health probe', ('result',))
+health_sweep_latency = metrics.histogram('hub_health_sweep_seconds', 'Duration of a health sweep (probes and commit)')
+health_sweeps_total = metrics.counter('hub_health_sweeps_total', 'Health sweeps run')
 
 #__________________________________________ HELPER FUNCTIONS to perform health check for a given channel
-def health_check(endpoint, authkey):
-    # make GET request to URL
-    # add authkey to request header
+def probe_channel(endpoint, authkey, expected_name):
+    start = time.perf_counter()
+    healthy = request_health(endpoint, authkey, expected_name)
+    health_probe_latency.observe(time.perf_counter() - start, result='healthy' if healthy else 'unhealthy')
+    return healthy
+
+def request_health(endpoint, authkey, expected_name):
+    # make GET request to URL, add authkey to request header (no database access here,
+    # so probes can run in worker threads)
     try:
-        response = requests.get(endpoint+'/health',
-                                headers={'Authorization': 'authkey '+authkey})
-    except requests.exceptions.RequestException as e:
+        response = health_session.get(endpoint+'/health',
+                                      headers={'Authorization': 'authkey '+authkey},
+                                      timeout=HEALTH_CHECK_TIMEOUT)
+        if response.status_code != 200:
+            return False
+        # check if response is JSON with {"name": <channel_name>}
+        body = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error: {e}")
         return False
-    if response.status_code != 200:
-        return False
-    # check if response is JSON with {"name": <channel_name>}
-    if 'name' not in response.json():
-        return False
     # check if channel name is as expected
     # (channels can't change their name, must be re-registered)
+    return isinstance(body, dict) and body.get('name') == expected_name
+
+def record_health(channel, healthy):
+    # only touch the row when something changes; the caller commits
+    if channel.active != healthy:
+        channel.active = healthy
+        record_change(channel.endpoint)
+    if healthy:
+        channel.last_heartbeat = datetime.datetime.now()
+
+def health_check(endpoint, authkey):
     channel = Channel.query.filter_by(endpoint=endpoint).first()
-    channel.active = False
-    db.session.commit()
     if not channel:
         print(f"Channel {endpoint} not found in database")
         return False
-    expected_name = channel.name
-    if response.json()['name'] != expected_name:
-        return False
-
-    # everything is OK, set last_heartbeat to now
-    channel.active = True
-    channel.last_heartbeat = datetime.datetime.now()
+    healthy = probe_channel(endpoint, authkey, channel.name)
+    record_health(channel, healthy)
     db.session.commit()  # save to database
-    return True
+    health_scheduler.reschedule(channel.id, healthy)
+    return healthy
+
+#__________________________________________BACKGROUND HEALTH CHECKS: concurrent sweeps with per-channel backoff
+class HealthScheduler(object):
+    def __init__(self, interval, max_interval, workers):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='health')
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.next_due = {}   # channel id -> time.monotonic() of the next probe
+        self.failures = {}   # channel id -> consecutive failed probes
+        self.thread = None
+
+    def reschedule(self, channel_id, healthy):
+        with self.lock:
+            failures = 0 if healthy else self.failures.get(channel_id, 0) + 1
+            self.failures[channel_id] = failures
+            delay = min(self.interval * 2 ** failures, self.max_interval)
+            self.next_due[channel_id] = time.monotonic() + delay * random.uniform(0.9, 1.1)  # jitter spreads the load
+
+    def trigger(self, channel_id=None):  # ask for an immediate check of one or all channels
+        with self.lock:
+            if channel_id is None:
+                self.next_due.clear()
+            else:
+                self.next_due[channel_id] = 0
+        self.wakeup.set()
+
+    def sweep(self, force=False):
+        with health_sweep_latency.time():
+            results = self._sweep(force)
+        health_sweeps_total.inc()
+        return results
+
+    def _sweep(self, force):
+        # probe all due channels concurrently, then store the results in one transaction
+        # (force: every channel, else the due ones this hub is responsible for, see FEDERATION)
+        now = time.monotonic()
+        with self.lock:
+            channels = []
+            for c in Channel.query.all():
+                if not force and not federation.owns(c.endpoint):
+                    self.next_due.pop(c.id, None)  # another hub checks it, due at once if it becomes ours
+                    self.failures.pop(c.id, None)
+                elif force or self.next_due.get(c.id, 0) <= now:
+                    channels.append(c)
+        futures = {c.id: self.executor.submit(probe_channel, c.endpoint, c.authkey, c.name) for c in channels}
+        results = {}
+        for channel in channels:
+            results[channel.endpoint] = healthy = futures[channel.id].result()
+            record_health(channel, healthy)
+            self.reschedule(channel.id, healthy)
+        db.session.commit()
+        return results
+
+    def run(self):
+        while True:
+            with app.app_context():
+                try:
+                    self.sweep()
+                except Exception as e:  # keep the scheduler alive, try again on the next tick
+                    print(f"Health sweep failed: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            with self.lock:
+                next_due = min(self.next_due.values(), default=time.monotonic() + self.interval)
+            self.wakeup.wait(max(1, min(next_due - time.monotonic(), self.interval)))
+            self.wakeup.clear()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='health-scheduler', daemon=True)
+            self.thread.start()
+
+health_scheduler = HealthScheduler(HEALTH_CHECK_INTERVAL, HEALTH_CHECK_MAX_INTERVAL, HEALTH_CHECK_WORKERS)
+metrics.gauge('hub_failing_channels', 'Channels whose last health probe failed',
+              lambda: sum(1 for failures in list(health_scheduler.failures.values()) if failures))
+
 #__________________________________________cli command to check health of all channels
 @app.cli.command('check_channels')
 def check_channels():
-    channels = Channel.query.all()
-    for channel in channels:
-        if not health_check(channel.endpoint, channel.authkey):
-            print(f"Channel {channel.endpoint} is not healthy")
+    for endpoint, healthy in health_scheduler.sweep(force=True).items():
+        if not healthy:
+            print(f"Channel {endpoint} is not healthy")
         else:
-            print(f"Channel {channel.endpoint} is healthy")
+            print(f"Channel {endpoint} is healthy")
 #__________________________________________ROUTES: Home page route - Displaying a list of all channels and is accessible to anyone
+# One page of channels at a time, with the same filters as GET /channels
 @app.route('/')
 def home_page():
-    channels = Channel.query.all()      # Query all channels from the database
-    return render_template("hub_home.html", channels=channels, STANDARD_CLIENT_URL=STANDARD_CLIENT_URL)
+    try:
+        channels, total, next_after = search_channels(request.args, HOME_PAGE_SIZE)
+    except ValueError as e:
+        return str(e), 400
+    filters = {k: v for k, v in request.args.items() if v and k in DIRECTORY_QUERY_ARGS and k not in ('after', 'limit')}
+    next_url = url_for('home_page', after=next_after, **filters) if next_after else None
+    return render_template("hub_home.html", channels=channels, total=total, filters=filters, next_url=next_url,
+                           STANDARD_CLIENT_URL=STANDARD_CLIENT_URL)
 
 #__________________________________________REST API ENDPOINTS: Flask REST route endpoints for creating or updating a channel (POST request)
-@app.route('/channels', methods=['POST'])
-def create_channel():
-    global SERVER_AUTHKEY
-    record = json.loads(request.data)
+def check_authorization(request):  # error message, or None if the request carries the server authkey
     if 'Authorization' not in request.headers:  #Authorization check
-        return "No authorization header", 400
+        return "No authorization header"
     if request.headers['Authorization'] != 'authkey ' + SERVER_AUTHKEY:
-        return "Invalid authorization header ({})".format(request.headers['Authorization']), 400
+        return "Invalid authorization header ({})".format(request.headers['Authorization'])
+    return None
+
+def validate_record(record):  # error message, or None for a complete channel record
+    if not isinstance(record, dict):
+        return "Record is not an object"
     if 'name' not in record:     
-        return "Record has no name", 400
+        return "Record has no name"
     if 'endpoint' not in record:
-        return "Record has no endpoint", 400
+        return "Record has no endpoint"
     if 'authkey' not in record:
-        return "Record has no authkey", 400
+        return "Record has no authkey"
     if 'type_of_service' not in record:
-        return "Record has no type of service representation", 400
+        return "Record has no type of service representation"
+    for key in ('name', 'endpoint', 'authkey', 'type_of_service'):
+        if not isinstance(record[key], str):
+            return "Record {} is not a string".format(key)
+    return None
+
+@app.route('/channels', methods=['POST'])
+def create_channel():
+    record = json.loads(request.data)
+    error = check_authorization(request) or validate_record(record)
+    if error:
+        return error, 400
     update_channel = Channel.query.filter_by(endpoint=record['endpoint']).first()
     print("update_channel: ", update_channel)
     if update_channel:  # If channel already exists, update it
         update_channel.name = record['name']
         update_channel.authkey = record['authkey']
         update_channel.type_of_service = record['type_of_service']
-        update_channel.active = False
-        db.session.commit()         # Save changes to the database
-        if not health_check(record['endpoint'], record['authkey']):     # Perform health check to validate channel status
+        record_change(record['endpoint'])
+        if not health_check(record['endpoint'], record['authkey']):     # Perform health check to validate channel status (commits the changes)
             return "Channel is not healthy", 400
         return jsonify(created=False,          
                        id=update_channel.id), 200
@@ -127,36 +308,597 @@ def create_channel():
                           last_heartbeat=datetime.datetime.now(),
                           active=True)
         db.session.add(channel)          # Add and commit the new channel to the database
+        record_change(record['endpoint'])
         db.session.commit() 
         if not health_check(record['endpoint'], record['authkey']):          # Perform health check & if health check fails, delete the newly created channel
             db.session.delete(channel)  # delete channel from database
+            record_change(record['endpoint'])
             db.session.commit()
             return "Channel is not healthy", 400         # Return JSON response indicating creation
         return jsonify(created=True, id=channel.id), 200
 
-# Endpoint for retrieving all channels (GET request)
+# Bulk registration: a JSON list of channel records, answered with one result per
+# record in the same order ({endpoint, ok, created, id} or {endpoint, ok, error}).
+# Same rules as POST /channels, but all channels are probed in parallel and the
+# results are stored in one transaction.
+@app.route('/channels/batch', methods=['POST'])
+def create_channels():
+    error = check_authorization(request)
+    if error:
+        return error, 400
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        return "Expected a list of channel records", 400
+    if len(records) > MAX_BATCH_RECORDS:
+        return "Too many channels (at most {})".format(MAX_BATCH_RECORDS), 400
+    results = [None] * len(records)
+    valid, seen = [], set()
+    for i, record in enumerate(records):
+        error = validate_record(record)
+        if not error and record['endpoint'].lower() in seen:
+            error = "Duplicate endpoint in batch"
+        if error:
+            results[i] = {'endpoint': record.get('endpoint') if isinstance(record, dict) else None, 'ok': False, 'error': error}
+        else:
+            seen.add(record['endpoint'].lower())
+            valid.append(i)
+    # probes don't touch the database, so they run on the health check workers
+    futures = {i: health_scheduler.executor.submit(probe_channel, records[i]['endpoint'], records[i]['authkey'], records[i]['name'])
+               for i in valid}
+    existing = {c.endpoint.lower(): c for c in Channel.query.filter(Channel.endpoint.in_([records[i]['endpoint'] for i in valid]))}
+    checked = []
+    for i in valid:
+        record, healthy = records[i], futures[i].result()
+        channel = existing.get(record['endpoint'].lower())
+        if channel is None and not healthy:  # a new channel has to be healthy to be created
+            results[i] = {'endpoint': record['endpoint'], 'ok': False, 'error': "Channel is not healthy"}
+            continue
+        created = channel is None
+        if created:
+            channel = Channel(endpoint=record['endpoint'], active=True)  # healthy, see above
+            db.session.add(channel)
+        channel.name = record['name']
+        channel.authkey = record['authkey']
+        channel.type_of_service = record['type_of_service']
+        record_change(record['endpoint'])
+        record_health(channel, healthy)
+        checked.append((i, channel, created, healthy))
+    db.session.commit()
+    for i, channel, created, healthy in checked:
+        health_scheduler.reschedule(channel.id, healthy)
+        if healthy:
+            results[i] = {'endpoint': channel.endpoint, 'ok': True, 'created': created, 'id': channel.id}
+        else:  # an existing channel keeps its updated record but is marked inactive
+            results[i] = {'endpoint': channel.endpoint, 'ok': False, 'error': "Channel is not healthy", 'id': channel.id}
+    return jsonify(results), 200
+
+#__________________________________________HEARTBEATS: channels report that they are alive, in batches
+# POST /heartbeat with a list of {endpoint, authkey}. Heartbeats are only
+# checked against the channel directory and buffered; a background thread
+# writes everything that arrived within HEARTBEAT_FLUSH_INTERVAL in one
+# transaction, and a channel that sends heartbeats is not probed by the hub.
+class HeartbeatBuffer(object):
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = {}  # endpoint -> time of the latest heartbeat
+        self.pid = None    # the flush thread does not survive a fork, restart it per process
+
+    def add(self, endpoints):
+        now = datetime.datetime.now()
+        with self.lock:
+            for endpoint in endpoints:
+                self.pending[endpoint] = now
+            if self.pid != os.getpid():
+                threading.Thread(target=self.run, name='heartbeat-flush', daemon=True).start()
+                self.pid = os.getpid()
 
+    def flush(self):  # -> number of channels written
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        channels = Channel.query.filter(Channel.endpoint.in_(list(pending))).all()
+        for channel in channels:
+            record_health(channel, True)
+            channel.last_heartbeat = pending.get(channel.endpoint, channel.last_heartbeat)
+        db.session.commit()
+        for channel in channels:
+            health_scheduler.reschedule(channel.id, True)
+        heartbeat_flushes_total.inc()
+        return len(channels)
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:  # keep the thread alive, the next heartbeats will be written
+                    print(f"Heartbeat flush failed: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+heartbeats = HeartbeatBuffer(HEARTBEAT_FLUSH_INTERVAL)
+heartbeats_total = metrics.counter('hub_heartbeats_total', 'Channel heartbeats received', ('result',))
+heartbeat_flushes_total = metrics.counter('hub_heartbeat_flushes_total', 'Transactions writing buffered heartbeats')
+
+@app.route('/heartbeat', methods=['POST'])
+def heartbeat():
+    error = check_authorization(request)
+    if error:
+        return error, 400
+    beats = request.get_json(silent=True)
+    if not isinstance(beats, list) or not all(isinstance(beat, dict) for beat in beats):
+        return "Expected a list of {endpoint, authkey} objects", 400
+    if len(beats) > MAX_BATCH_RECORDS:
+        return "Too many heartbeats (at most {})".format(MAX_BATCH_RECORDS), 400
+    records = {e.lower(): r for e, r in directory.current().records.items()}
+    accepted, unknown = [], []
+    for beat in beats:
+        record = records.get(str(beat.get('endpoint')).lower())
+        if record is not None and record['authkey'] == beat.get('authkey'):
+            accepted.append(record['endpoint'])
+        else:
+            unknown.append(beat.get('endpoint'))  # not registered (or wrong authkey): register first
+    heartbeats.add(accepted)
+    heartbeats_total.inc(len(accepted), result='accepted')
+    heartbeats_total.inc(len(unknown), result='unknown')
+    return jsonify(accepted=len(accepted), unknown=unknown), 202
+
+#__________________________________________CHANNEL DIRECTORY: in-memory snapshot of the public channel list
+# The snapshot is rebuilt only when the change log has moved on (one indexed
+# lookup per request, so it also notices changes made by other worker processes).
+def public_record(channel):
+    return {'name': channel.name,
+            'endpoint': channel.endpoint,
+            'authkey': channel.authkey,
+            'type_of_service': channel.type_of_service,
+            'active': channel.active}
+
+class ChannelDirectory(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.records = {}   # endpoint -> public record
+        self.bodies = {}    # (content type, encoding) -> serialized full listing, built on first use
+
+    def current(self):
+        version = db.session.query(db.func.max(ChannelChange.id)).scalar() or 0
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    records = {c.endpoint: public_record(c) for c in Channel.query.all()}
+                    self.records = records
+                    self.bodies = {}
+                    self.version = version
+        return self
+
+    def listing(self, content_type, encoding):  # -> (body, content type, encoding or None), once per version
+        with self.lock:  # concurrent requests wait for one encoding instead of each making their own
+            key = (content_type, encoding)
+            if key not in self.bodies:
+                body, used_type = wire.encode({'version': self.version, 'channels': list(self.records.values())}, content_type)
+                if encoding is None or len(body) < wire.MIN_COMPRESS_BYTES:
+                    self.bodies[key] = (body, used_type, None)
+                else:
+                    self.bodies[key] = (wire.compress(body, encoding, cached=True), used_type, encoding)
+            return self.bodies[key]
+
+    def delta(self, since_version):  # channels changed or removed after since_version
+        endpoints = {e for (e,) in db.session.query(ChannelChange.endpoint).filter(ChannelChange.id > since_version).distinct()}
+        records = {e.lower(): r for e, r in self.records.items()}  # endpoints compare case-insensitively
+        return {'version': self.version,
+                'delta': True,
+                'channels': [records[e.lower()] for e in endpoints if e.lower() in records],
+                'removed': [e for e in endpoints if e.lower() not in records]}
+
+directory = ChannelDirectory()
+
+#__________________________________________DIRECTORY QUERIES: indexes, name search, filters and pagination
+# IF NOT EXISTS, so databases created before these indexes get them on the next start
+DIRECTORY_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_channels_type_active ON channels (type_of_service, is_active)',
+    'CREATE INDEX IF NOT EXISTS ix_channels_active ON channels (is_active)',
+    'CREATE INDEX IF NOT EXISTS ix_channels_last_heartbeat ON channels (last_heartbeat)',
+    'CREATE INDEX IF NOT EXISTS ix_channel_changes_endpoint ON channel_changes (endpoint, id)',
+]
+# Full-text index over channel names (SQLite FTS5), kept in sync with the channels table by triggers
+NAME_SEARCH_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS channel_names USING fts5(name, content='channels', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS channel_names_insert AFTER INSERT ON channels BEGIN "
+    "INSERT INTO channel_names(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS channel_names_delete AFTER DELETE ON channels BEGIN "
+    "INSERT INTO channel_names(channel_names, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS channel_names_update AFTER UPDATE OF name ON channels BEGIN "
+    "INSERT INTO channel_names(channel_names, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO channel_names(rowid, name) VALUES (new.id, new.name); END",
+]
+DIRECTORY_QUERY_ARGS = ('q', 'type_of_service', 'active', 'heartbeat_within', 'limit', 'after')
+DIRECTORY_PAGE_SIZE = 100      # channels per page of GET /channels?limit=...
+DIRECTORY_MAX_PAGE_SIZE = 1000
+HOME_PAGE_SIZE = 50
+
+def create_directory_indexes():  # -> True if full-text name search is available
+    for statement in DIRECTORY_INDEXES:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        exists = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'channel_names'")).first() is not None
+        for statement in NAME_SEARCH_SCHEMA:
+            db.session.execute(db.text(statement))
+        if not exists:  # index the channels registered before the search table existed
+            db.session.execute(db.text("INSERT INTO channel_names(channel_names) VALUES ('rebuild')"))
+        db.session.commit()
+        return True
+    except db.exc.OperationalError as e:  # SQLite built without FTS5: fall back to LIKE
+        print(f"Full-text channel search not available: {e}")
+        db.session.rollback()
+        return False
+
+name_search_available = create_directory_indexes()
+
+def search_channels(args, default_limit):
+    # -> (channels, total matching, id to continue after or None); ValueError for invalid arguments
+    query = Channel.query
+    if args.get('type_of_service'):
+        query = query.filter(Channel.type_of_service == args['type_of_service'])
+    if args.get('active'):  # empty form fields mean no filter
+        if args['active'].lower() not in ('1', '0', 'true', 'false'):
+            raise ValueError("Invalid active parameter (true or false)")
+        query = query.filter(Channel.active == (args['active'].lower() in ('1', 'true')))
+    if args.get('heartbeat_within'):  # seconds
+        try:
+            seconds = float(args['heartbeat_within'])
+            if not 0 <= seconds < float('inf'):  # also rejects nan
+                raise ValueError
+            since = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+        except OverflowError:  # further back than datetime goes: every heartbeat
+            since = datetime.datetime.min
+        except ValueError:
+            raise ValueError("Invalid heartbeat_within parameter (seconds)")
+        query = query.filter(Channel.last_heartbeat >= since)
+    terms = re.findall(r'\w+', args.get('q', ''))
+    if terms and name_search_available:
+        # every word as a prefix, quoted so user input is never parsed as FTS5 syntax
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        names = db.text('SELECT rowid FROM channel_names WHERE channel_names MATCH :match')
+        query = query.filter(Channel.id.in_(names.bindparams(match=match).columns(db.column('rowid'))))
+    elif terms:
+        for term in terms:
+            query = query.filter(Channel.name.ilike('%' + term + '%'))
+    try:
+        limit = min(int(args.get('limit', default_limit)), DIRECTORY_MAX_PAGE_SIZE)
+        after = int(args.get('after', 0))
+    except ValueError:
+        raise ValueError("Invalid limit or after parameter")
+    if limit < 1:
+        raise ValueError("Invalid limit or after parameter")
+    total = query.count()
+    # keyset pagination: the primary key index finds the start of any page directly
+    channels = query.filter(Channel.id > after).order_by(Channel.id).limit(limit + 1).all()
+    next_after = channels[limit - 1].id if len(channels) > limit else None
+    return channels[:limit], total, next_after
+
+# Endpoint for retrieving all channels (GET request)
+# Supports If-None-Match (ETag is the directory version) and ?since_version=<v>,
+# which returns only the channels changed or removed since version <v>.
+# Any of q (name search), type_of_service, active, heartbeat_within (seconds),
+# limit and after (pagination cursor) returns one page of matching channels:
+# {version, channels, total, next_after} instead of the whole directory.
 @app.route('/channels', methods=['GET'])
 def get_channels():
-    channels = Channel.query.all()     # Query all channels from the database
-    return jsonify(channels=[{'name': c.name,         # Return JSON response containing all channels' data
-                              'endpoint': c.endpoint,
-                              'authkey': c.authkey,
-                              'type_of_service': c.type_of_service} for c in channels]), 200
+    snapshot = directory.current()
+    etag = str(snapshot.version)
+    # heartbeats don't change the version, so a recency filter can't be revalidated with it
+    if 'heartbeat_within' not in request.args and not is_resource_modified(request.environ, etag=etag):
+        response = app.response_class(status=304)
+    elif any(arg in request.args for arg in DIRECTORY_QUERY_ARGS):
+        try:
+            channels, total, next_after = search_channels(request.args, DIRECTORY_PAGE_SIZE)
+        except ValueError as e:
+            return str(e), 400
+        response = wire.respond({'version': snapshot.version, 'channels': [public_record(c) for c in channels],
+                                 'total': total, 'next_after': next_after})
+        if 'heartbeat_within' in request.args:
+            return response
+    else:
+        since_version = request.args.get('since_version', type=int)
+        if since_version and since_version <= snapshot.version:
+            response = wire.respond(snapshot.delta(since_version))
+        else:
+            # JSON or MessagePack, compressed if the client accepts it (see wire.py)
+            body, content_type, encoding = snapshot.listing(*wire.negotiate(request.headers.get('Accept'),
+                                                                            request.headers.get('Accept-Encoding')))
+            response = app.response_class(body, mimetype=content_type)
+            response.vary.add('Accept')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/health', methods=['GET'])
 def health():
-    # check either all channels or a specific channel (if id is provided)
+    # schedule an immediate check of either all channels or a specific channel (if id is provided);
+    # the background scheduler runs it, so this request never waits for a slow channel
     if 'id' in request.args:
-        channel = Channel.query.filter_by(id=request.args['id']).first()
-        health_check(channel.endpoint, channel.authkey)
+        channel_id = request.args.get('id', type=int)
+        if channel_id is None:  # not a sweep of every channel by mistake
+            return "Invalid id parameter (channel id)", 400
+        health_scheduler.trigger(channel_id)
     else:
-        channels = Channel.query.all()
-        for channel in channels:
-            health_check(channel.endpoint, channel.authkey)
+        health_scheduler.trigger()
 
     # flask redirect to home page
     return redirect(url_for('home_page'))
 
-#__________________________________________________________________APPLICATION ENTRY POINT: Run the Flask application on port 5555 in debug mode
+#__________________________________________FEDERATION: several hubs sharing one channel directory
+# Every hub accepts registrations and heartbeats and serves the whole directory.
+# Registration changes are replicated through the change log: each hub pulls
+# GET /federation/changes?after=<id> from each of its peers (HUB_PEERS) and
+# applies what is newer than its own record of a channel, by (stamp, origin).
+# Records are sent as they are now, so applying them again or in a different
+# order gives the same directory, and a hub also passes on what it got from others.
+# Health checks are split between the hubs that are up: a consistent hash ring
+# assigns each channel to one hub. When a peer has not answered for PEER_TIMEOUT
+# seconds its channels move to the remaining hubs, and back when it returns.
+# Heartbeat times are pulled separately (GET /federation/heartbeats), so they don't
+# move the directory version; each hub keeps the latest time it has seen of a channel.
+REPLICATION_INTERVAL = 1.0        # seconds between pulls from each peer
+REPLICATION_BATCH = 1000          # changes per GET /federation/changes
+REPLICATION_TIMEOUT = (1, 5)      # (connect, read) timeout in seconds for one pull
+PEER_TIMEOUT = 10                 # seconds without an answer before a peer's channels are taken over
+HEARTBEAT_OVERLAP = 10            # seconds each heartbeat pull reaches back, for heartbeats committed late
+HASH_RING_REPLICAS = 64           # points per hub on the ring, spreads the channels evenly
+
+def upgrade_change_log():
+    # change logs created before federation get the version columns (old changes count as stamp 0)
+    columns = {row[1] for row in db.session.execute(db.text('PRAGMA table_info(channel_changes)'))}
+    for name, column_type in (('stamp', 'FLOAT'), ('origin', 'VARCHAR(200)')):
+        if name not in columns:
+            db.session.execute(db.text('ALTER TABLE channel_changes ADD COLUMN {} {}'.format(name, column_type)))
+    db.session.commit()
+    change_clock.observe(db.session.query(db.func.max(ChannelChange.stamp)).scalar() or 0)
+
+if db.engine.dialect.name == 'sqlite':
+    upgrade_change_log()
+
+def change_version(change):
+    return (change.stamp or 0, change.origin or HUB_URL)
+
+def latest_changes(endpoints):  # endpoint (lower case) -> its latest ChannelChange, the version of its record
+    ids = db.session.query(db.func.max(ChannelChange.id)).filter(ChannelChange.endpoint.in_(endpoints)).group_by(ChannelChange.endpoint)
+    return {c.endpoint.lower(): c for c in ChannelChange.query.filter(ChannelChange.id.in_(ids.scalar_subquery()))}
+
+def replicated_record(channel):
+    return dict(public_record(channel), last_heartbeat=channel.last_heartbeat.isoformat() if channel.last_heartbeat else None)
+
+def apply_changes(changes):  # changes pulled from a peer -> number that were newer than ours; the caller commits
+    endpoints = [change['endpoint'] for change in changes]
+    latest = latest_changes(endpoints)
+    channels = {c.endpoint.lower(): c for c in Channel.query.filter(Channel.endpoint.in_(endpoints))}
+    applied = 0
+    for change in changes:
+        key = change['endpoint'].lower()
+        if key in latest and change_version(latest[key]) >= (change['stamp'], change['origin']):
+            continue  # we have this change or a later one
+        record, channel = change['record'], channels.get(key)
+        if record is None:  # removed
+            if channel is not None:
+                db.session.delete(channel)
+                del channels[key]
+        else:
+            if channel is None:
+                channel = channels[key] = Channel(endpoint=record['endpoint'])
+                db.session.add(channel)
+            channel.name = record['name']
+            channel.authkey = record['authkey']
+            channel.type_of_service = record['type_of_service']
+            channel.active = record['active']
+            heartbeat = datetime.datetime.fromisoformat(record['last_heartbeat']) if record.get('last_heartbeat') else None
+            if heartbeat and (channel.last_heartbeat is None or heartbeat > channel.last_heartbeat):
+                channel.last_heartbeat = heartbeat
+        # logged with the original version, so this hub's clients and peers see the change too
+        latest[key] = ChannelChange(endpoint=change['endpoint'], stamp=change['stamp'], origin=change['origin'])
+        db.session.add(latest[key])
+        change_clock.observe(change['stamp'])
+        applied += 1
+    return applied
+
+def apply_heartbeats(heartbeats):  # endpoint -> iso time from a peer -> number newer than ours; the caller commits
+    heartbeats = {endpoint.lower(): heartbeat for endpoint, heartbeat in heartbeats.items()}
+    channels = Channel.query.filter(Channel.endpoint.in_(list(heartbeats))).all()
+    applied = 0
+    for channel in channels:
+        heartbeat = datetime.datetime.fromisoformat(heartbeats[channel.endpoint.lower()])
+        if channel.last_heartbeat is None or heartbeat > channel.last_heartbeat:
+            channel.last_heartbeat = heartbeat
+            applied += 1
+    return applied
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HashRing(object):
+    def __init__(self, nodes, replicas=HASH_RING_REPLICAS):
+        self.nodes = sorted(nodes)
+        points = sorted((ring_hash('{}#{}'.format(node, i)), node) for node in self.nodes for i in range(replicas))
+        self.points = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key):  # the first node clockwise from the key's hash
+        return self.owners[bisect.bisect(self.points, ring_hash(key.lower())) % len(self.points)]
+
+class Federation(object):
+    def __init__(self, hub_url, peers):
+        self.hub_url = hub_url
+        self.peers = [peer for peer in peers if peer != hub_url]
+        self.session = requests.Session()
+        self.cursors = {peer: 0 for peer in self.peers}  # id in the peer's change log we have applied up to
+        self.heartbeat_cursors = {peer: None for peer in self.peers}  # the peer's time of its last heartbeat pull
+        started = time.monotonic()
+        self.last_seen = {peer: started for peer in self.peers}  # peers count as up until they miss PEER_TIMEOUT
+        self.ring = HashRing([hub_url] + self.peers)
+        self.thread = None
+
+    def owns(self, endpoint):  # is this hub the one that health-checks the channel?
+        return not self.peers or self.ring.owner(endpoint) == self.hub_url
+
+    def live_peers(self):
+        now = time.monotonic()
+        return [peer for peer in self.peers if now - self.last_seen[peer] < PEER_TIMEOUT]
+
+    def update_ring(self):
+        members = sorted([self.hub_url] + self.live_peers())
+        if members != self.ring.nodes:
+            print(f"Hubs sharing the health checks: {', '.join(members)}")
+            self.ring = HashRing(members)
+            health_scheduler.wakeup.set()  # channels taken over are due at once
+
+    def pull(self, peer):  # -> number of changes applied from the peer's change log
+        applied = 0
+        while True:
+            response = self.session.get(peer + '/federation/changes', params={'after': self.cursors[peer]},
+                                        headers={'Authorization': 'authkey ' + SERVER_AUTHKEY, 'Accept': wire.ACCEPT},
+                                        timeout=REPLICATION_TIMEOUT)
+            if response.status_code != 200:
+                raise ValueError(f"{response.status_code} {response.text[:200]}")
+            page = wire.decode_response(response)
+            self.last_seen[peer] = time.monotonic()
+            if page['version'] < self.cursors[peer]:  # the peer has a new database, start over
+                self.cursors[peer] = 0
+                continue
+            applied += apply_changes(page['changes'])
+            db.session.commit()
+            self.cursors[peer] = page['next_after']
+            if not page['more']:
+                return applied
+
+    def pull_heartbeats(self, peer):  # -> number of channels whose last heartbeat moved forward
+        response = self.session.get(peer + '/federation/heartbeats', params={'after': self.heartbeat_cursors[peer] or ''},
+                                    headers={'Authorization': 'authkey ' + SERVER_AUTHKEY, 'Accept': wire.ACCEPT},
+                                    timeout=REPLICATION_TIMEOUT)
+        if response.status_code != 200:
+            raise ValueError(f"{response.status_code} {response.text[:200]}")
+        page = wire.decode_response(response)
+        applied = apply_heartbeats(page['heartbeats'])
+        db.session.commit()
+        since = datetime.datetime.fromisoformat(page['now']) - datetime.timedelta(seconds=HEARTBEAT_OVERLAP)
+        self.heartbeat_cursors[peer] = since.isoformat()
+        return applied
+
+    def run(self):
+        while True:
+            for peer in self.peers:
+                with app.app_context():
+                    try:
+                        replicated_changes_total.inc(self.pull(peer))
+                        replicated_heartbeats_total.inc(self.pull_heartbeats(peer))
+                    except Exception as e:  # keep replicating, e.g. after "database is locked", try again on the next round
+                        print(f"Replication from {peer} failed: {e}")
+                        db.session.rollback()
+                    finally:
+                        db.session.remove()
+            self.update_ring()
+            time.sleep(REPLICATION_INTERVAL)
+
+    def start(self):
+        if self.thread is None and self.peers:
+            self.thread = threading.Thread(target=self.run, name='replication', daemon=True)
+            self.thread.start()
+
+    def status(self):
+        now = time.monotonic()
+        live = self.live_peers()
+        endpoints = [endpoint for (endpoint,) in db.session.query(Channel.endpoint)]
+        return {'hub': self.hub_url,
+                'members': self.ring.nodes,
+                'peers': [{'url': peer, 'alive': peer in live, 'cursor': self.cursors[peer],
+                           'last_seen': round(now - self.last_seen[peer], 1)} for peer in self.peers],
+                'channels': len(endpoints),
+                'owned': sum(1 for endpoint in endpoints if self.owns(endpoint)),
+                'version': directory.current().version}
+
+federation = Federation(HUB_URL, HUB_PEERS)
+replicated_changes_total = metrics.counter('hub_replicated_changes_total', 'Channel changes applied from peer hubs')
+replicated_heartbeats_total = metrics.counter('hub_replicated_heartbeats_total', 'Newer channel heartbeat times from peer hubs')
+metrics.gauge('hub_live_peers', 'Peer hubs that answered within PEER_TIMEOUT', lambda: len(federation.live_peers()))
+
+# One page of the change log after <id>: the current record (or null if removed)
+# and version of every channel changed in it. Needs the server authkey, as the
+# records include the channels' authkeys.
+@app.route('/federation/changes', methods=['GET'])
+def get_changes():
+    error = check_authorization(request)
+    if error:
+        return error, 400
+    after = request.args.get('after', 0, type=int)
+    limit = max(1, min(request.args.get('limit', REPLICATION_BATCH, type=int), REPLICATION_BATCH))
+    rows = (db.session.query(ChannelChange.id, ChannelChange.endpoint).filter(ChannelChange.id > after)
+            .order_by(ChannelChange.id).limit(limit).all())
+    endpoints = list({endpoint.lower(): endpoint for _, endpoint in rows}.values())
+    latest = latest_changes(endpoints)
+    channels = {c.endpoint.lower(): c for c in Channel.query.filter(Channel.endpoint.in_(endpoints))}
+    changes = []
+    for key, change in latest.items():
+        stamp, origin = change_version(change)
+        channel = channels.get(key)
+        changes.append({'endpoint': change.endpoint, 'stamp': stamp, 'origin': origin,
+                        'record': replicated_record(channel) if channel is not None else None})
+    version = db.session.query(db.func.max(ChannelChange.id)).scalar() or 0
+    return wire.respond({'hub': HUB_URL, 'version': version, 'changes': changes,
+                         'next_after': rows[-1].id if rows else after, 'more': len(rows) == limit})
+
+# Channels with a heartbeat (or healthy probe) after <iso time>, and this hub's time
+# to ask from next. Not paged: at most one entry per channel.
+@app.route('/federation/heartbeats', methods=['GET'])
+def get_heartbeats():
+    error = check_authorization(request)
+    if error:
+        return error, 400
+    now = datetime.datetime.now()
+    query = db.session.query(Channel.endpoint, Channel.last_heartbeat).filter(Channel.last_heartbeat.isnot(None))
+    if request.args.get('after'):
+        try:
+            query = query.filter(Channel.last_heartbeat > datetime.datetime.fromisoformat(request.args['after']))
+        except ValueError:
+            return "Invalid after parameter (ISO time)", 400
+    return wire.respond({'hub': HUB_URL, 'now': now.isoformat(),
+                         'heartbeats': {endpoint: heartbeat.isoformat() for endpoint, heartbeat in query}})
+
+# Which hubs are up and how many channels this one health-checks
+@app.route('/federation', methods=['GET'])
+def federation_status():
+    return jsonify(federation.status())
+
+#__________________________________________BACKGROUND TASKS: health checks and replication in one process per hub
+# A WSGI server with several worker processes imports this module in each of
+# them (hub.wsgi). Only the process holding the lock file next to the database
+# runs the health checks and the replication, so a channel is not probed once
+# per worker. The others wait on the lock and take over when that process exits.
+def background_lock_path():
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        return url.database + '.lock'
+    return os.path.abspath('hub.lock')
+
+def run_background_tasks(lock_path):
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)  # stays open (and locked) until the process exits
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    health_scheduler.start()
+    federation.start()
+
+def start_background_tasks():  # returns at once, the tasks start when this process gets the lock
+    threading.Thread(target=run_background_tasks, args=(background_lock_path(),), name='hub-background', daemon=True).start()
+
+#__________________________________________________________________APPLICATION ENTRY POINT: Run the Flask application on port 5555 (or the port in HUB_URL) in debug mode
 if __name__ == '__main__':
-    app.run(port=5555, debug=True)
\ No newline at end of file
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':  # only in the reloader's serving process
+        health_scheduler.start()
+        federation.start()
+    app.run(port=urllib.parse.urlsplit(HUB_URL).port or 5555, debug=True)
\ No newline at end of file
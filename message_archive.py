@@ -0,0 +1,226 @@
+#__________________________________________IMPORTS
+import contextlib
+import fcntl
+import functools
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import zlib
+from message_store import connect_sqlite
+
+#__________________________________________Message Archive: messages compacted out of a channel's store
+# Messages are written in blocks of `block_messages`, each block compressed
+# with zlib and appended to a segment file (segment-000001.log, ...). An
+# SQLite index next to the segments records where every block is and holds a
+# full-text index (FTS5, contentless) of the message texts, so /history and
+# /search read only the blocks they return messages from, never the archive.
+#
+#   archive/
+#       index.sqlite     blocks(first_id, last_id, segment, offset, length), archive_fts, archive_terms
+#       segment-000001.log
+#       open.jsonl       the newest messages, until there are enough for a block
+#
+# The store hands over every message that leaves its hot window, usually one at
+# a time: they are indexed at once and wait in open.jsonl to fill a block.
+# Nothing stays open between calls, a host with many channels keeps no file
+# descriptors per archive.
+#
+# A search word matches every word it is a prefix of (whole words only below
+# MIN_PREFIX_LENGTH characters). FTS5 reads the whole
+# doclist of a prefix term ("pic"*), slow for common words, so words are
+# expanded through a sorted table of all indexed terms instead and searched as
+# ("pica" OR "picasso"), which stops after the newest `limit` matches.
+
+MIN_PREFIX_LENGTH = 3  # shorter search words only match whole words
+MAX_PREFIX_TERMS = 256  # longer expansions use the FTS5 prefix query
+
+def words(text):  # the tokens FTS5 (unicode61, diacritics kept) indexes; never FTS5 syntax
+    return re.findall(r'[^\W_]+', text.lower())
+
+def matches(message, query):  # the same rule for messages that are not archived yet
+    tokens = words('{} {}'.format(message.get('content', ''), message.get('sender', '')))
+    return all(any(token == term or len(term) >= MIN_PREFIX_LENGTH and token.startswith(term) for token in tokens)
+               for term in words(query))
+
+
+class MessageArchive(object):
+    def __init__(self, directory, block_messages=256, segment_bytes=64 * 2 ** 20, cache_blocks=4):
+        self.directory = directory
+        self.block_messages = block_messages  # messages compressed together
+        self.segment_bytes = segment_bytes    # start a new segment file after this size
+        self.open_path = os.path.join(directory, 'open.jsonl')
+        # decompressed blocks, the newest ones are read over and over by /history
+        self._read_block = functools.lru_cache(maxsize=cache_blocks)(self._load_block)
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS blocks ('
+                         'first_id INTEGER PRIMARY KEY, last_id INTEGER NOT NULL, '
+                         'segment INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL)')
+            try:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5("
+                             "text, sender, content='', columnsize=0, tokenize='unicode61 remove_diacritics 0')")
+                conn.execute('CREATE TABLE IF NOT EXISTS archive_terms (term TEXT PRIMARY KEY) WITHOUT ROWID')
+                self.searchable = True
+            except sqlite3.OperationalError:  # SQLite built without FTS5: history only
+                self.searchable = False
+
+    @contextlib.contextmanager
+    def _connection(self):  # one connection per call, see above
+        conn = connect_sqlite(os.path.join(self.directory, 'index.sqlite'))
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, 'segment-{:06d}.log'.format(segment))
+
+    def _sealed_id(self, conn):  # newest message id in a block, 0 if there is none
+        return conn.execute('SELECT COALESCE(MAX(last_id), 0) FROM blocks').fetchone()[0]
+
+    def _open_lines(self):
+        try:
+            with open(self.open_path, 'rb') as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def _read_open(self, conn, lines=None):  # the messages waiting for a block, oldest first
+        lines = self._open_lines() if lines is None else lines
+        sealed_id = self._sealed_id(conn)
+        messages = []
+        for line in lines:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue  # torn write from a crashed process
+            if message['id'] > sealed_id:  # else sealed just before a crash, before open.jsonl was rewritten
+                messages.append(message)
+        return messages
+
+    def last_id(self):  # newest archived message id, 0 if the archive is empty
+        with self._connection() as conn:
+            pending = self._read_open(conn)
+            return pending[-1]['id'] if pending else self._sealed_id(conn)
+
+    def add(self, messages):  # messages oldest first; ids already archived are skipped
+        with open(os.path.join(self.directory, 'archive.lock'), 'w') as lock, self._connection() as conn:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # one writer across worker processes
+            lines, last_id = self._open_lines(), self._sealed_id(conn)
+            for line in reversed(lines):  # only the newest waiting message, unless a block is full
+                try:
+                    last_id = max(last_id, json.loads(line)['id'])
+                    break
+                except ValueError:
+                    continue
+            messages = [m for m in messages if m['id'] > last_id]
+            if not messages:
+                return 0
+            pending, full = messages, 0
+            if len(lines) + len(messages) >= self.block_messages:
+                pending = self._read_open(conn, lines) + messages
+                full = len(pending) - len(pending) % self.block_messages
+            blocks = self._write_blocks(conn, pending[:full])
+            with conn:
+                conn.executemany('INSERT INTO blocks (first_id, last_id, segment, offset, length) VALUES (?, ?, ?, ?, ?)', blocks)
+                if self.searchable:
+                    rows = [(m['id'], str(m.get('content', '')), str(m.get('sender', ''))) for m in messages]
+                    conn.executemany('INSERT INTO archive_fts (rowid, text, sender) VALUES (?, ?, ?)', rows)
+                    conn.executemany('INSERT OR IGNORE INTO archive_terms (term) VALUES (?)',
+                                     [(term,) for term in set(words(' '.join(text + ' ' + sender for _, text, sender in rows)))])
+            # after the blocks are in the index, so a crash in between loses nothing
+            # (rewritten with what is left after sealing blocks, else the new messages are appended)
+            lines = ''.join(json.dumps(m, ensure_ascii=False) + '\n' for m in pending[full:]).encode('utf-8')
+            if full:
+                fd, tmp_path = tempfile.mkstemp(prefix='open.', suffix='.tmp', dir=self.directory)
+                with open(fd, 'wb') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.open_path)
+            else:
+                with open(self.open_path, 'a+b') as f:
+                    size = f.tell()
+                    if size and os.pread(f.fileno(), 1, size - 1) != b'\n':
+                        lines = b'\n' + lines  # terminate a torn last line, readers skip it
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+            return len(messages)
+
+    def _write_blocks(self, conn, messages):  # -> block rows for the index, the segments are written and synced
+        segment, size = conn.execute('SELECT COALESCE(MAX(segment), 1) FROM blocks').fetchone()[0], 0
+        if os.path.exists(self._segment_path(segment)):
+            size = os.path.getsize(self._segment_path(segment))
+        blocks = []
+        for start in range(0, len(messages), self.block_messages):
+            block = messages[start:start + self.block_messages]
+            data = zlib.compress('\n'.join(json.dumps(m, ensure_ascii=False) for m in block).encode('utf-8'))
+            if size and size + len(data) > self.segment_bytes:
+                segment, size = segment + 1, 0
+            with open(self._segment_path(segment), 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())  # blocks are durable before the index points at them
+            blocks.append((block[0]['id'], block[-1]['id'], segment, size, len(data)))
+            size += len(data)
+        return blocks
+
+    def _load_block(self, segment, offset, length):  # -> {id: message}
+        with open(self._segment_path(segment), 'rb') as f:
+            data = os.pread(f.fileno(), length, offset)
+        messages = (json.loads(line) for line in zlib.decompress(data).decode('utf-8').split('\n'))
+        return {m['id']: m for m in messages}
+
+    def history(self, before_id, limit):  # up to `limit` messages with id < before_id, oldest first
+        with self._connection() as conn:
+            messages = [m for m in reversed(self._read_open(conn)) if m['id'] < before_id]  # newest first
+            rows = conn.execute('SELECT segment, offset, length FROM blocks WHERE first_id < ? '
+                                'ORDER BY first_id DESC', (before_id,))
+            for segment, offset, length in rows:  # newest block first, usually one or two are enough
+                if len(messages) >= limit:
+                    break
+                block = self._read_block(segment, offset, length)
+                messages.extend(m for i, m in sorted(block.items(), reverse=True) if i < before_id)
+        return messages[:limit][::-1]
+
+    def _expand(self, conn, term):  # indexed words starting with term, None if there are too many
+        if len(term) < MIN_PREFIX_LENGTH:
+            return [row[0] for row in conn.execute('SELECT term FROM archive_terms WHERE term = ?', (term,))]
+        upper = term[:-1] + chr(ord(term[-1]) + 1)
+        expansion = [row[0] for row in conn.execute('SELECT term FROM archive_terms WHERE term >= ? AND term < ? LIMIT ?',
+                                                    (term, upper, MAX_PREFIX_TERMS + 1))]
+        return expansion if len(expansion) <= MAX_PREFIX_TERMS else None
+
+    def search(self, query, limit, before_id=None):  # newest matching messages first
+        terms = words(query)
+        if not terms or not self.searchable:
+            return []
+        with self._connection() as conn:
+            groups = []
+            for term in terms:
+                expansion = self._expand(conn, term)
+                if expansion == []:
+                    return []  # no archived message has a word starting with term
+                groups.append('"{}"*'.format(term) if expansion is None
+                              else '(' + ' OR '.join('"{}"'.format(word) for word in expansion) + ')')
+            ids = [row[0] for row in conn.execute(
+                'SELECT rowid FROM archive_fts WHERE archive_fts MATCH ? AND rowid < ? ORDER BY rowid DESC LIMIT ?',
+                (' AND '.join(groups), before_id if before_id is not None else 2 ** 62, limit))]
+            pending = {m['id']: m for m in self._read_open(conn)} if ids and ids[0] > self._sealed_id(conn) else {}
+            messages = []
+            for message_id in ids:
+                if message_id in pending:
+                    messages.append(pending[message_id])
+                    continue
+                row = conn.execute('SELECT segment, offset, length FROM blocks WHERE first_id <= ? '
+                                   'ORDER BY first_id DESC LIMIT 1', (message_id,)).fetchone()
+                block = self._read_block(*row) if row else {}
+                if message_id in block:  # else indexed, but lost from open.jsonl in a crash
+                    messages.append(block[message_id])
+        return messages
+
+    def close(self):
+        self._read_block.cache_clear()
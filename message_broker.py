@@ -0,0 +1,76 @@
+#__________________________________________IMPORTS
+import queue
+import threading
+
+#__________________________________________Errors
+class TooManySubscribers(Exception):
+    pass
+
+
+#__________________________________________Subscription: one waiting client (long-poll request or SSE stream)
+# Every subscriber gets a bounded queue. A subscriber that falls behind is not
+# allowed to grow memory: once its queue is full it is marked as overflowed and
+# has to catch up from the message store with its last seen id instead.
+class Subscription(object):
+    def __init__(self, broker, max_queue, notify=None):
+        self.broker = broker
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+        self.notify = notify  # optional callback after each publish, e.g. to wake an event loop
+
+    def get(self, timeout):  # list of new messages, or [] on timeout (0 does not block)
+        try:
+            batch = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        messages = list(batch)
+        while True:  # drain whatever else is already queued
+            try:
+                messages.extend(self.queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#__________________________________________Broker: wakes subscribers when messages are committed
+class MessageBroker(object):
+    def __init__(self, max_subscribers=1000, max_queue=100):
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self, notify=None):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers()
+            subscription = Subscription(self, self.max_queue, notify)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, messages):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(messages)
+            except queue.Full:  # slow consumer, let it resync from the store
+                subscription.overflowed = True
+            if subscription.notify is not None:
+                subscription.notify()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
@@ -0,0 +1,352 @@
+#__________________________________________IMPORTS
+import collections
+import fcntl
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+#__________________________________________Retention Policy: how many messages a channel keeps
+# Retention is applied lazily: readers only ever see the newest `max_messages`
+# messages (the ring buffer does that for free), and the backing storage is
+# compacted only once it has grown by `compact_after` messages past the limit.
+# `max_bytes` additionally caps the serialized size of the messages kept in
+# memory, so one channel with huge messages can't use up a shared process.
+class RetentionPolicy(object):
+    def __init__(self, max_messages=10, compact_after=1000, max_bytes=None):
+        self.max_messages = max_messages
+        self.compact_after = compact_after
+        self.max_bytes = max_bytes
+
+    def needs_compaction(self, stored_count):
+        return stored_count > self.max_messages + self.compact_after
+
+
+def connect_sqlite(path):  # WAL: readers and the one writer don't block each other
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+#__________________________________________Storage Backend Interface
+# on_evict gets every message as soon as it falls out of the newest
+# `max_messages` (the hot window), so an archive holds everything older than
+# what recent() returns; compactions hand off again whatever it did not take.
+class MessageStore(object):
+    def __init__(self, retention=None, on_evict=None):
+        self.retention = retention or RetentionPolicy()
+        self.on_evict = on_evict  # called with the messages a compaction removes, e.g. to archive them
+        self._lock = threading.Lock()  # guards the in-memory ring buffer
+        self._recent = collections.deque(maxlen=self.retention.max_messages)
+        self._sizes = collections.deque(maxlen=self.retention.max_messages)  # serialized size of each message
+        self._bytes = 0
+        self._last_id = 0           # ids are assigned by the store and only ever increase
+        self._last_modified = None  # unix time of the newest write
+
+    def append(self, message):  # append one message, returns the stored message
+        return self.append_many([message])[0]
+
+    def append_many(self, messages):  # assigns ids, returns the stored messages
+        raise NotImplementedError
+
+    def recent(self):  # newest messages, oldest first, retention applied
+        with self._lock:
+            self._refresh()
+            return list(self._recent)
+
+    def since(self, after_id=0, limit=None):  # messages with id > after_id, oldest first
+        with self._lock:
+            self._refresh()
+            messages = [m for m in self._recent if m['id'] > after_id]
+        if limit is not None:
+            messages = messages[:limit] if after_id else messages[-limit:]
+        return messages
+
+    def backlog(self):  # every message still in the backing storage (not compacted yet), oldest first
+        raise NotImplementedError
+
+    def state(self):  # (last id, last modified) without reading any message bodies twice
+        with self._lock:
+            self._refresh()
+            return self._last_id, self._last_modified
+
+    def memory_usage(self):  # serialized bytes of the messages held in memory
+        with self._lock:
+            return self._bytes
+
+    def _remember(self, message, size):  # caller holds self._lock
+        if len(self._recent) == self._recent.maxlen:
+            self._bytes -= self._sizes[0]  # about to fall out of the ring buffer
+        self._recent.append(message)
+        self._sizes.append(size)
+        self._bytes += size
+        if self.retention.max_bytes is not None:
+            while self._bytes > self.retention.max_bytes and len(self._recent) > 1:
+                self._recent.popleft()
+                self._bytes -= self._sizes.popleft()
+
+    def _forget_all(self):
+        self._recent.clear()
+        self._sizes.clear()
+        self._bytes = 0
+
+    def _left_window(self, before, stored):  # messages this append pushed out of the hot window; caller holds self._lock
+        kept = {m['id'] for m in self._recent}
+        return [m for m in before + stored if m['id'] not in kept]
+
+    def evict_backlog(self):  # hands off the stored messages outside the hot window, e.g. those from before an archive
+        with self._lock:
+            self._refresh()
+            kept = {m['id'] for m in self._recent}
+        self._evict([m for m in self.backlog() if m['id'] not in kept])
+
+    def _evict(self, messages):  # False if the messages could not be handed off, keep them then
+        if self.on_evict is None or not messages:
+            return True
+        try:
+            self.on_evict(messages)
+            return True
+        except Exception as e:  # never fail a write because of the archive, retry at the next compaction
+            print(f"Could not hand off {len(messages)} old messages: {e}")
+            return False
+
+    def _assign_ids(self, messages):
+        stored = []
+        for message in messages:
+            self._last_id += 1
+            stored.append(dict(message, id=self._last_id))
+        return stored
+
+    def _refresh(self):  # pick up writes from other worker processes
+        raise NotImplementedError
+
+    def _import_legacy(self, legacy_path):  # one-off import of the old whole-file JSON array
+        try:
+            with open(legacy_path, 'r') as f:
+                messages = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return
+        if messages:
+            self.append_many(messages)
+
+    def close(self):
+        pass
+
+
+#__________________________________________Append-Only Log Backend (one JSON document per line)
+# A compacted log starts with a header line {"log_generation": n, "last_id": id}.
+# Each compaction writes the next generation, which is how other processes tell
+# that the log was replaced (the file system may give the new file an inode
+# number the log had before), and last_id keeps the ids increasing.
+GENERATION_KEY = 'log_generation'
+
+def read_header(f):  # -> (generation, last id) from the start of an open log, (0, 0) for an uncompacted one
+    f.seek(0)
+    line = f.read(128)
+    if not line.startswith(b'{"' + GENERATION_KEY.encode('ascii')):
+        return 0, 0
+    try:
+        header = json.loads(line[:line.index(b'\n')])
+        return header[GENERATION_KEY], header['last_id']
+    except (ValueError, KeyError):
+        return 0, 0
+
+class JsonlMessageStore(MessageStore):
+    def __init__(self, path, retention=None, fsync=True, legacy_path=None, on_evict=None):
+        super().__init__(retention, on_evict)
+        self.path = path
+        self.fsync = fsync
+        self._offset = 0        # how far into the log this process has read
+        self._generation = None # compactions replace the file, see read_header
+        self._stored = 0        # lines in the current log file
+        if legacy_path and not os.path.exists(path):
+            self._import_legacy(legacy_path)
+
+    def _open_locked(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)  # serializes writers across worker processes
+            try:
+                # our open fd keeps its inode number from being reused, so this comparison is safe
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            # another process compacted the log while we waited for the lock
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def append_many(self, messages):
+        with self._lock:
+            fd = self._open_locked()
+            try:
+                self._refresh()  # the last id may have been written by another process
+                before = list(self._recent)
+                messages = self._assign_ids(messages)
+                lines = [json.dumps(m, ensure_ascii=False) + '\n' for m in messages]
+                size = os.fstat(fd).st_size
+                # a crash mid-write can leave a torn last line; terminate it so
+                # the next record starts on a fresh line (readers skip the torn one)
+                if size and os.pread(fd, 1, size - 1) != b'\n':
+                    lines[0] = '\n' + lines[0]
+                os.write(fd, ''.join(lines).encode('utf-8'))
+                if self.fsync:
+                    os.fsync(fd)
+                self._refresh()
+                self._evict(self._left_window(before, messages))  # if this fails, the next compaction hands them off
+                if self.retention.needs_compaction(self._stored):
+                    self._compact(fd)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        return messages
+
+    def _refresh(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            generation, last_id = read_header(f)
+            if generation != self._generation or st.st_size < self._offset:  # log was compacted by someone
+                self._generation = generation
+                self._last_id = max(self._last_id, last_id)
+                self._offset = 0
+                self._stored = 0
+                self._forget_all()
+            if st.st_size == self._offset:
+                return
+            self._last_modified = st.st_mtime
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        end = data.rfind(b'\n') + 1  # only consume complete lines
+        for line in data[:end].splitlines():
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue  # torn write from a crashed process
+            if GENERATION_KEY in message:
+                continue
+            if 'id' not in message:  # written before the store assigned ids
+                message['id'] = self._last_id + 1
+            self._last_id = max(self._last_id, message['id'])
+            self._remember(message, len(line))
+            self._stored += 1
+        self._offset += end
+
+    def _read_log(self):
+        messages = []
+        with open(self.path, 'rb') as f:
+            for line in f.read().splitlines():
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    continue  # torn write from a crashed process
+        return messages
+
+    def backlog(self):  # bounded by max_messages + compact_after lines
+        try:
+            return [m for m in self._read_log() if 'id' in m]
+        except FileNotFoundError:
+            return []
+
+    def _compact(self, fd):  # caller holds the file lock
+        kept = {m['id'] for m in self._recent}
+        if not self._evict([m for m in self.backlog() if m['id'] not in kept]):
+            return
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                                        dir=os.path.dirname(self.path) or '.')
+        os.fchmod(fd, 0o644)
+        with open(fd, 'w') as f:
+            f.write(json.dumps({GENERATION_KEY: self._generation + 1, 'last_id': self._last_id}) + '\n')
+            for message in self._recent:
+                f.write(json.dumps(message, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)  # atomic, so readers see the old or the new log
+        self._refresh()
+
+
+#__________________________________________SQLite Backend (WAL mode)
+class SqliteMessageStore(MessageStore):
+    def __init__(self, path, retention=None, legacy_path=None, on_evict=None):
+        super().__init__(retention, on_evict)
+        self.path = path
+        self._local = threading.local()  # sqlite connections are per thread
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS messages ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'body TEXT NOT NULL, written_at REAL)')
+            if 'written_at' not in [row[1] for row in conn.execute('PRAGMA table_info(messages)')]:
+                conn.execute('ALTER TABLE messages ADD COLUMN written_at REAL')  # unix time, for Last-Modified
+            empty = conn.execute('SELECT 1 FROM messages LIMIT 1').fetchone() is None
+        if legacy_path and empty:
+            self._import_legacy(legacy_path)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def append_many(self, messages):
+        conn = self._connect()
+        stored = []
+        with self._lock, conn:
+            conn.execute('BEGIN IMMEDIATE')  # one writer at a time, so the hot window below is this append's
+            self._refresh()
+            before = list(self._recent)
+            written_at = time.time()
+            for message in messages:  # the row id becomes the message id
+                cursor = conn.execute('INSERT INTO messages (body, written_at) VALUES (?, ?)',
+                                      (json.dumps(message, ensure_ascii=False), written_at))
+                stored.append(dict(message, id=cursor.lastrowid))
+            self._refresh()
+            self._evict(self._left_window(before, stored))
+            first_id, last_id = conn.execute('SELECT MIN(id), MAX(id) FROM messages').fetchone()
+            if self.retention.needs_compaction(last_id - first_id + 1):
+                cutoff = last_id - self.retention.max_messages
+                evicted = conn.execute('SELECT id, body FROM messages WHERE id <= ? ORDER BY id', (cutoff,)).fetchall()
+                if self._evict([dict(json.loads(body), id=row_id) for row_id, body in evicted]):
+                    conn.execute('DELETE FROM messages WHERE id <= ?', (cutoff,))
+        return stored
+
+    def backlog(self):
+        rows = self._connect().execute('SELECT id, body FROM messages ORDER BY id').fetchall()
+        return [dict(json.loads(body), id=row_id) for row_id, body in rows]
+
+    def _refresh(self):
+        rows = self._connect().execute(
+            'SELECT id, body, written_at FROM messages WHERE id > ? ORDER BY id DESC LIMIT ?',
+            (self._last_id, self.retention.max_messages)).fetchall()
+        for row_id, body, _ in reversed(rows):
+            self._remember(dict(json.loads(body), id=row_id), len(body))
+            self._last_id = row_id
+        # when the newest message was written, the same in every process (rows from before written_at: the file's time)
+        if rows:
+            self._last_modified = rows[0][2] or os.path.getmtime(self.path)
+        elif self._last_modified is None:
+            row = self._connect().execute('SELECT written_at FROM messages ORDER BY id DESC LIMIT 1').fetchone()
+            self._last_modified = row[0] if row and row[0] else os.path.getmtime(self.path)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+#__________________________________________Backend Factory
+STORES = {
+    'jsonl': JsonlMessageStore,
+    'sqlite': SqliteMessageStore,
+}
+
+def create_store(kind, path, retention=None, **options):
+    if kind not in STORES:
+        raise ValueError("Unknown message store: {}".format(kind))
+    return STORES[kind](path, retention=retention, **options)
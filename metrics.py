@@ -0,0 +1,235 @@
+#__________________________________________IMPORTS
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from flask import Response, g, request
+
+#__________________________________________Metrics shared by hub, channel and client
+# Counters and latency histograms kept in process memory and exposed at
+# /metrics in the Prometheus text format. Recording a value is a dict lookup
+# and an addition under a lock, so instrumenting hot paths is cheap.
+# Each process (or pre-forked worker) keeps its own numbers.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+MAX_PROFILE_SECONDS = 60
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in pairs) + '}'
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(float)  # label values -> count
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] += amount
+
+    def lines(self):
+        with self.lock:
+            values = dict(self.values)
+        return ['{}{} {}'.format(self.name, _label_text(self.labelnames, key), _number(value))
+                for key, value in sorted(values.items())]
+
+
+class Gauge(object):
+    kind = 'gauge'
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function  # called at scrape time, so nothing is recorded in between
+
+    def lines(self):
+        return ['{} {}'.format(self.name, _number(self.function()))]
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> [count per bucket (+Inf last), sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):  # with histogram.time(stage='store'): ...
+        return _Timer(self, labels)
+
+    def lines(self):
+        with self.lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(self.name, _label_text(self.labelnames, key, [('le', _number(bound))]), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _label_text(self.labelnames, key), _number(total)))
+            lines.append('{}_count{} {}'.format(self.name, _label_text(self.labelnames, key), count))
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = collections.OrderedDict()  # name -> metric
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        # a module imported twice (e.g. as __main__ and by name) gets the same metric back
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric {} is already registered as a {}".format(name, metric.kind))
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def gauge(self, name, help, function):
+        with self.lock:  # the latest function wins, it refers to the live objects
+            metric = self.metrics[name] = Gauge(name, help, function)
+            return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+
+REQUEST_LATENCY = histogram('http_request_duration_seconds', 'Time until the response starts, by route',
+                            ('method', 'route', 'status'))
+_started = time.time()
+gauge('process_uptime_seconds', 'Seconds since the process started', lambda: time.time() - _started)
+
+#__________________________________________Sampling Profiler: wall-clock stacks of all threads, on demand
+# Nothing runs until a capture is requested. The result is in the collapsed
+# stack format ("thread;outer;inner count" per line) used by flamegraph.pl and speedscope.
+class ProfilerBusy(Exception):
+    pass
+
+_profile_lock = threading.Lock()
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        own_thread = threading.get_ident()
+        stacks = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in stacks.most_common())
+    finally:
+        _profile_lock.release()
+
+#__________________________________________Flask Integration: per-route timing, /metrics and /debug/profile
+def is_local_request(request):
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+def instrument(app, authorize=is_local_request):
+    # authorize(request) guards the profiler, which exposes code paths of the whole process
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        if 'metrics_start' in g:  # streamed responses are timed until their first byte
+            route = request.url_rule.rule if request.url_rule else 'unmatched'  # templates, not raw paths
+            REQUEST_LATENCY.observe(time.perf_counter() - g.metrics_start,
+                                    method=request.method, route=route, status=response.status_code)
+        return response
+
+    def metrics_view():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    def profile_view():
+        if not authorize(request):
+            return "Invalid authorization", 400
+        try:
+            seconds = float(request.args.get('seconds', 5))
+            interval = float(request.args.get('interval', PROFILE_INTERVAL))
+        except ValueError:
+            return "Invalid seconds or interval parameter", 400
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or not 0.001 <= interval <= 1:
+            return "seconds must be in (0, {}], interval in [0.001, 1]".format(MAX_PROFILE_SECONDS), 400
+        try:
+            return Response(sample_stacks(seconds, interval), mimetype='text/plain')
+        except ProfilerBusy:
+            return "A profile is already being captured", 409
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+    app.add_url_rule('/debug/profile', 'debug_profile', profile_view, methods=['GET'])
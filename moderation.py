@@ -0,0 +1,187 @@
+#__________________________________________IMPORTS
+# scikit-learn and better_profanity are heavy, they are only imported when the
+# first message is scored (or when preload() is called before forking workers)
+import gc
+import hashlib
+import json
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+import metrics
+
+MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'offtopic_model.pkl')
+MODEL_VERSION = 1  # bump when the features or the model type change
+
+#_________________________________________Off-Topic Detection using Naive Bayes
+# Sample training data for off-topic detection
+relevant_sentences = [
+    "Let's talk about Renaissance art.",
+    "Who is your favorite Impressionist painter?",
+    "I love Vincent van Gogh's Starry Night!",
+    "Can we discuss the Baroque period?",
+    "What do you think about Picasso's influence on modern art?"
+]
+
+irrelevant_sentences = [
+    "I love watching football on weekends.",
+    "What's your favorite movie?",
+    "Let's talk about cooking recipes.",
+    "I need help with my math homework.",
+    "Who is the best pop singer today?"
+]
+
+# Labels: 1 for relevant, 0 for irrelevant
+training_sentences = relevant_sentences + irrelevant_sentences
+labels = [1] * len(relevant_sentences) + [0] * len(irrelevant_sentences)
+
+def training_hash():  # identifies the training data an artifact was built from
+    return hashlib.sha256(json.dumps([training_sentences, labels]).encode('utf-8')).hexdigest()
+
+#_________________________________________Model Artifact: trained offline, loaded lazily
+def train_model():
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    import sklearn
+    # Vectorization and Model Training
+    vectorizer = CountVectorizer()
+    X = vectorizer.fit_transform(training_sentences)
+    model = MultinomialNB()
+    model.fit(X, labels)
+    return {'version': MODEL_VERSION,
+            'sklearn_version': sklearn.__version__,
+            'training_hash': training_hash(),
+            'vectorizer': vectorizer,
+            'model': model}
+
+def save_model(artifact, path=MODEL_FILE):
+    # a temporary file of its own, so processes building the artifact at once don't write into each other's
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path) or '.')
+    try:
+        os.fchmod(fd, 0o644)
+        with open(fd, 'wb') as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def load_model(path=MODEL_FILE):
+    # returns None if there is no usable artifact (missing, outdated, not ours or built with another scikit-learn)
+    try:
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError, TypeError):
+        return None
+    import sklearn
+    if (not isinstance(artifact, dict) or artifact.get('version') != MODEL_VERSION or artifact.get('training_hash') != training_hash()
+            or artifact.get('sklearn_version') != sklearn.__version__):
+        return None
+    return artifact
+
+_model = None
+_profanity = None
+_load_lock = threading.Lock()
+
+def get_model():
+    global _model
+    if _model is None:
+        with _load_lock:
+            if _model is None:
+                artifact = load_model()
+                if artifact is None:
+                    print("No off-topic model artifact at {}, training it now "
+                          "(run 'flask --app channel.py train_model' to build it offline)".format(MODEL_FILE))
+                    artifact = train_model()
+                _model = artifact
+    return _model
+
+def get_profanity():
+    global _profanity
+    if _profanity is None:
+        with _load_lock:
+            if _profanity is None:
+                from better_profanity import profanity
+                profanity.load_censor_words() # Loading profanity filter
+                _profanity = profanity
+    return _profanity
+
+def preload():
+    # Load everything now, e.g. in a pre-forking server's master process. Freezing
+    # the heap afterwards keeps the garbage collector from touching these objects,
+    # so forked workers keep sharing the pages copy-on-write.
+    get_model()
+    get_profanity()
+    gc.freeze()
+
+def is_off_topic(content):
+    return off_topic_many([content])[0]
+
+def off_topic_many(contents):  # one transform/predict call for the whole batch
+    artifact = get_model()
+    predictions = artifact['model'].predict(artifact['vectorizer'].transform(contents))
+    return [prediction == 0 for prediction in predictions]  # True if off-topic
+
+#_________________________________________Scoring: profanity and off-topic verdicts for many messages at once
+stage_latency = metrics.histogram('moderation_stage_seconds', 'Time per moderation stage and batch', ('stage',))
+batch_sizes = metrics.histogram('moderation_batch_size', 'Messages scored together', buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+def moderate_many(contents):
+    profanity = get_profanity()
+    with stage_latency.time(stage='profanity'):
+        verdicts = [{'profane': profanity.contains_profanity(content), 'off_topic': False} for content in contents]
+    # profane messages are rejected anyway, only classify the rest
+    clean = [i for i, verdict in enumerate(verdicts) if not verdict['profane']]
+    if clean:
+        with stage_latency.time(stage='classifier'):
+            off_topic = off_topic_many([contents[i] for i in clean])
+        for i, result in zip(clean, off_topic):
+            verdicts[i]['off_topic'] = bool(result)
+    return verdicts
+
+#_________________________________________Micro-Batching: requests wait briefly so concurrent messages are scored together
+class ModerationBatcher(object):
+    def __init__(self, max_batch_size=32, max_wait=0.005):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait       # seconds the first message of a batch waits for company
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None               # the worker thread does not survive a fork, restart it per process
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), name='moderation', daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, content):  # returns a Future with the verdict for one message
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((content, future))
+        return future
+
+    def score(self, content, timeout=None):
+        return self.submit(content).result(timeout)
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while len(batch) < self.max_batch_size:
+                    batch.append(pending.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            batch_sizes.observe(len(batch))
+            try:
+                verdicts = moderate_many([content for content, _ in batch])
+            except Exception as e:  # hand the error to every waiting request
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), verdict in zip(batch, verdicts):
+                future.set_result(verdict)
@@ -0,0 +1,170 @@
+#__________________________________________IMPORTS
+import random
+import threading
+import time
+import urllib.parse
+import requests
+import requests.adapters
+import metrics
+
+#__________________________________________Errors
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    # raised without sending anything while an endpoint's circuit is open
+    pass
+
+
+request_latency = metrics.histogram('outbound_request_seconds', 'Outbound calls to channels and the hub, per attempt',
+                                    ('method', 'outcome'))
+rejected_total = metrics.counter('outbound_rejected_total', 'Calls not sent because the circuit was open')
+retries_total = metrics.counter('outbound_retries_total', 'Retried outbound calls')
+
+#__________________________________________Circuit Breaker: fail fast while an endpoint is down
+# closed:    requests go through, consecutive failures are counted
+# open:      requests fail immediately until `reset_timeout` has passed
+# half-open: one trial request decides whether to close or re-open the circuit
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            self.trial_running = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.failure_threshold or self.opened_at is not None:
+                    self.opened_at = time.monotonic()
+
+
+#__________________________________________Per-Endpoint Statistics
+class EndpointStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0           # connection errors, timeouts and 5xx responses
+        self.timeouts = 0
+        self.rejected = 0         # not sent because the circuit was open
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_error = None
+
+    def as_dict(self):
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'retries': self.retries,
+                'avg_ms': round(self.total_seconds / self.requests * 1000, 1) if self.requests else None,
+                'max_ms': round(self.max_seconds * 1000, 1),
+                'last_error': self.last_error}
+
+
+#__________________________________________Outbound Client: one pooled session for all channel and hub calls
+class OutboundClient(object):
+    IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, timeout=(3.05, 10), retries=2, backoff=0.2, pool_size=10,
+                 failure_threshold=5, reset_timeout=30):
+        self.timeout = timeout              # (connect, read) seconds
+        self.retries = retries              # extra attempts for idempotent requests
+        self.backoff = backoff              # base of the exponential backoff, in seconds
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.session = requests.Session()
+        # the adapter keeps one connection pool per host, reused with keep-alive
+        adapter = requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.endpoint_stats = {}
+
+    def _for_endpoint(self, endpoint):
+        with self.lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self.endpoint_stats[endpoint] = EndpointStats()
+            return self.breakers[endpoint], self.endpoint_stats[endpoint]
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        # endpoint: key for the circuit breaker and the statistics, defaults to scheme://host:port
+        if endpoint is None:
+            parts = urllib.parse.urlsplit(url)
+            endpoint = '{}://{}'.format(parts.scheme, parts.netloc)
+        breaker, stats = self._for_endpoint(endpoint)
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = 1 + (self.retries if method.upper() in self.IDEMPOTENT else 0)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                with self.lock:
+                    stats.rejected += 1
+                rejected_total.inc()
+                raise CircuitOpenError("Circuit open for {}".format(endpoint))
+            if attempt:
+                with self.lock:
+                    stats.retries += 1
+                retries_total.inc()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                response, error = None, e
+            else:
+                error = None
+            elapsed = time.monotonic() - start
+            failed = error is not None or response.status_code >= 500
+            outcome = 'timeout' if isinstance(error, requests.exceptions.Timeout) else 'error' if failed else 'ok'
+            request_latency.observe(elapsed, method=method.upper(), outcome=outcome)
+            with self.lock:
+                stats.requests += 1
+                stats.total_seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+                if failed:
+                    stats.errors += 1
+                    stats.timeouts += outcome == 'timeout'
+                    stats.last_error = str(error) if error else 'HTTP {}'.format(response.status_code)
+            breaker.record(not failed)
+            if not failed or attempt == attempts - 1:
+                break
+            # exponential backoff with full jitter, so retries from many workers spread out
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        if error is not None:
+            raise error
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            endpoints = list(self.endpoint_stats)
+        return {endpoint: dict(self.endpoint_stats[endpoint].as_dict(), circuit=self.breakers[endpoint].state)
+                for endpoint in endpoints}
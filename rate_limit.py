@@ -0,0 +1,119 @@
+#__________________________________________IMPORTS
+import collections
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+#__________________________________________Token Buckets: rate limits for posting messages
+# Every key (a sender in a channel, a client IP address) has a bucket holding
+# up to `burst` tokens, refilled at `rate` tokens per second. A post takes one
+# token from each of its buckets, or from none of them if one is empty; the
+# caller then gets the seconds until it may try again (Retry-After).
+#
+# LocalTokenBuckets keep the buckets in process memory. SharedTokenBuckets keep
+# them in a memory-mapped file, so the limits hold across WSGI worker processes
+# (put the file on tmpfs, e.g. /dev/shm, to keep it off the disk).
+
+def _refill(tokens, stamp, now, rate, burst):
+    return burst if stamp is None else min(burst, tokens + max(now - stamp, 0) * rate)
+
+def _wait(tokens, rate):  # seconds until a bucket holding `tokens` has one
+    return (1 - tokens) / rate
+
+
+class LocalTokenBuckets(object):
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys  # least recently used buckets are dropped (and start full again)
+        self.lock = threading.Lock()
+        self.buckets = collections.OrderedDict()  # key -> (tokens, time of the last update)
+
+    def take(self, limits, now=None):  # limits: [(key, rate, burst)] -> 0 or seconds to wait
+        now = time.time() if now is None else now
+        with self.lock:
+            levels = [_refill(*self.buckets.get(key, (None, None)), now, rate, burst) for key, rate, burst in limits]
+            wait = max([_wait(tokens, rate) for tokens, (_, rate, _) in zip(levels, limits) if tokens < 1] or [0])
+            for tokens, (key, _, _) in zip(levels, limits):
+                self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def close(self):
+        pass
+
+
+class SharedTokenBuckets(object):
+    # The file is a hash table of `slots` fixed-size slots: (key hash, tokens, time of
+    # the last update). A key lives in one of PROBE slots after its hash; when they
+    # are all taken, the least recently updated one is reused (that bucket starts full).
+    SLOT = struct.Struct('<Qdd')
+    PROBE = 8
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self.lock = threading.Lock()  # flock does not exclude threads sharing the file descriptor
+        self.fd = self.map = None
+        self.pid = None  # the file is opened in each process: after a fork (gunicorn --preload) a shared descriptor gives no exclusion
+
+    def _open(self):  # caller holds self.lock
+        if self.map is not None:  # inherited from the parent process
+            self.close()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.slots * self.SLOT.size
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size != size:  # new file, or one made for a different table size
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+        self.pid = os.getpid()
+
+    def _slot(self, key):  # -> (offset, key hash, tokens, stamp); stamp None for a new bucket
+        digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+        start = digest % self.slots
+        oldest = None
+        for i in range(self.PROBE):
+            offset = (start + i) % self.slots * self.SLOT.size
+            stored, tokens, stamp = self.SLOT.unpack_from(self.map, offset)
+            if stored == digest:
+                return offset, digest, tokens, stamp
+            if stored == 0:
+                return offset, digest, 0.0, None
+            if oldest is None or stamp < oldest[1]:
+                oldest = (offset, stamp)
+        return oldest[0], digest, 0.0, None
+
+    def take(self, limits, now=None):  # same as LocalTokenBuckets.take, across processes
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.pid != os.getpid():
+                self._open()
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                slots = [self._slot(key) for key, _, _ in limits]
+                levels = [_refill(tokens, stamp, now, rate, burst)
+                          for (_, _, tokens, stamp), (_, rate, burst) in zip(slots, limits)]
+                wait = max([_wait(tokens, rate) for tokens, (_, rate, _) in zip(levels, limits) if tokens < 1] or [0])
+                for tokens, (offset, digest, _, _) in zip(levels, slots):
+                    self.SLOT.pack_into(self.map, offset, digest, tokens - 1 if not wait else tokens, now)
+                return wait
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            os.close(self.fd)
+            self.fd = self.map = None
+
+
+def create_buckets(path=None, **options):  # in process memory, or shared through the file at path
+    return SharedTokenBuckets(path, **options) if path else LocalTokenBuckets(**options)
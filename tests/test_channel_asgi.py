@@ -0,0 +1,33 @@
+import asyncio
+import os
+import shutil
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+def call(app, path, headers=()):  # -> the events the app sent
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+             'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers], 'client': ('127.0.0.1', 1)}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(event):
+        sent.append(event)
+
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+def test_header_names_are_lower_case(tmp_path, monkeypatch):
+    shutil.copy(os.path.join(REPO, 'feedback_topics.json'), str(tmp_path))
+    monkeypatch.chdir(tmp_path)  # the channel keeps its messages in the working directory
+    import channel_asgi
+    for path, headers in (('/', [('authorization', 'authkey 1234567890')]), ('/', []), ('/health', [])):
+        start = call(channel_asgi.app, path, headers)[0]
+        names = [name for name, _ in start['headers']]
+        assert names == [name.lower() for name in names], names
+    assert b'etag' in [name for name, _ in call(channel_asgi.app, '/', [('authorization', 'authkey 1234567890')])[0]['headers']]
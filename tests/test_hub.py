@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['HUB_DATABASE_URI'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'hub.sqlite')
+import hub
+
+HEADERS = {'Authorization': 'authkey ' + hub.SERVER_AUTHKEY}
+UNREACHABLE = 'http://127.0.0.1:9'  # nothing listens there, so the probe fails at once
+
+
+def test_batch_rejects_records_with_wrong_types():
+    records = [{'name': 'Good', 'endpoint': UNREACHABLE, 'authkey': 'key', 'type_of_service': 'aiweb24:chat'},
+               {'name': 'Bad endpoint', 'endpoint': 123, 'authkey': 'key', 'type_of_service': 'aiweb24:chat'},
+               {'name': 'Bad authkey', 'endpoint': UNREACHABLE + '1', 'authkey': 42, 'type_of_service': 'aiweb24:chat'},
+               {'name': None, 'endpoint': UNREACHABLE + '2', 'authkey': 'key', 'type_of_service': 'aiweb24:chat'},
+               'not a record']
+    response = hub.app.test_client().post('/channels/batch', json=records, headers=HEADERS)
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [r['error'] for r in results] == ["Channel is not healthy", "Record endpoint is not a string",
+                                             "Record authkey is not a string", "Record name is not a string",
+                                             "Record is not an object"]
+
+
+def test_heartbeat_within_out_of_range():
+    client = hub.app.test_client()
+    for value in ('1e12', '1e308', '60'):
+        assert client.get('/channels?heartbeat_within=' + value).status_code == 200
+    for value in ('1e309', 'inf', 'nan', '-5', 'soon'):
+        assert client.get('/channels?heartbeat_within=' + value).status_code == 400
+
+
+def test_health_rejects_malformed_id():
+    client = hub.app.test_client()
+    assert client.get('/health?id=abc').status_code == 400
+    assert client.get('/health?id=1').status_code == 302
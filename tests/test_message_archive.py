@@ -0,0 +1,34 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from message_archive import MessageArchive
+from message_store import JsonlMessageStore, RetentionPolicy
+
+
+def open_files():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def test_history_and_search_cover_every_message(tmp_path):
+    archive = MessageArchive(str(tmp_path / 'archive'), block_messages=16)
+    store = JsonlMessageStore(str(tmp_path / 'messages.jsonl'), RetentionPolicy(max_messages=10, compact_after=50),
+                              fsync=False, on_evict=archive.add)
+    for i in range(1, 301):
+        store.append({'content': 'message number{} about picasso'.format(i), 'sender': 'tester'})
+    hot = store.recent()
+    # the archive has every message that left the hot window, without waiting for a compaction
+    assert [m['id'] for m in archive.history(hot[0]['id'], 1000)] + [m['id'] for m in hot] == list(range(1, 301))
+    assert [m['id'] for m in archive.history(100, 5)] == [95, 96, 97, 98, 99]
+    assert [m['id'] for m in archive.search('number290', 5)] == [290]  # still waiting for a block
+    assert [m['id'] for m in archive.search('pica', 3, before_id=50)] == [49, 48, 47]
+
+
+def test_archive_keeps_no_files_open(tmp_path):
+    before = open_files()
+    archives = [MessageArchive(str(tmp_path / 'archive{}'.format(i))) for i in range(20)]
+    for archive in archives:
+        archive.add([{'id': 1, 'content': 'hello', 'sender': 'tester'}])
+        archive.history(2, 10)
+        archive.search('hello', 10)
+    assert open_files() == before
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from message_store import JsonlMessageStore, RetentionPolicy, SqliteMessageStore
+
+PROCESSES = 4
+APPENDS = 300
+
+
+def append_messages(path, worker, compact_after, ids):
+    store = JsonlMessageStore(path, RetentionPolicy(max_messages=10, compact_after=compact_after), fsync=False)
+    stored = [store.append({'content': 'message {}'.format(i), 'sender': 'worker {}'.format(worker)})['id']
+              for i in range(APPENDS)]
+    ids.put(stored)
+
+
+def append_in_processes(path, compact_after):  # -> every id handed out, by all processes
+    context = multiprocessing.get_context('fork')
+    ids = context.Queue()
+    processes = [context.Process(target=append_messages, args=(path, worker, compact_after, ids))
+                 for worker in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    handed_out = [i for _ in processes for i in ids.get(timeout=60)]
+    for process in processes:
+        process.join(60)
+    return handed_out
+
+
+def test_ids_unique_across_processes_with_compaction(tmp_path):
+    ids = append_in_processes(str(tmp_path / 'messages.jsonl'), compact_after=50)
+    assert len(ids) == PROCESSES * APPENDS
+    assert len(set(ids)) == len(ids)
+
+
+def test_ids_unique_across_processes_without_compaction(tmp_path):
+    ids = append_in_processes(str(tmp_path / 'messages.jsonl'), compact_after=10 ** 6)
+    assert len(set(ids)) == PROCESSES * APPENDS
+
+
+def test_reader_follows_compaction(tmp_path):
+    path = str(tmp_path / 'messages.jsonl')
+    retention = RetentionPolicy(max_messages=10, compact_after=5)
+    reader = JsonlMessageStore(path, retention, fsync=False)
+    writer = JsonlMessageStore(path, retention, fsync=False)
+    for i in range(100):
+        writer.append({'content': str(i), 'sender': 'writer'})
+        assert reader.state()[0] == i + 1
+    assert [m['content'] for m in reader.recent()] == [str(i) for i in range(90, 100)]
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
+
+
+def test_sqlite_last_modified_same_in_every_process(tmp_path):
+    path = str(tmp_path / 'messages.sqlite')
+    writer = SqliteMessageStore(path, RetentionPolicy(max_messages=10))
+    writer.append({'content': 'hello', 'sender': 'writer'})
+    time.sleep(0.05)
+    reader = SqliteMessageStore(path, RetentionPolicy(max_messages=10))
+    assert reader.state() == writer.state()
+    writer.append({'content': 'again', 'sender': 'writer'})
+    time.sleep(0.05)
+    assert reader.state() == writer.state()
@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import moderation
+
+PROCESSES = 4
+
+
+def build(path):
+    for _ in range(20):
+        moderation.save_model(moderation.train_model(), path)
+
+
+def test_stale_or_foreign_artifact_is_a_cache_miss(tmp_path):
+    path = str(tmp_path / 'model.pkl')
+    for artifact in (['not', 'a', 'dict'], {'version': moderation.MODEL_VERSION - 1}, 'text'):
+        with open(path, 'wb') as f:
+            pickle.dump(artifact, f)
+        assert moderation.load_model(path) is None
+    with open(path, 'wb') as f:
+        f.write(b'not a pickle')
+    assert moderation.load_model(path) is None
+
+
+def test_processes_saving_at_once_leave_a_loadable_artifact(tmp_path):
+    path = str(tmp_path / 'model.pkl')
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=build, args=(path,)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+    assert all(process.exitcode == 0 for process in processes)
+    assert moderation.load_model(path) is not None
+    assert os.listdir(str(tmp_path)) == ['model.pkl']
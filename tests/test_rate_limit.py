@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rate_limit import SharedTokenBuckets
+
+PROCESSES = 4
+BURST = 2000
+
+
+def take_all(buckets, granted):
+    granted.put(sum(1 for _ in range(1000) if not buckets.take([('sender', 1e-6, BURST)])))
+
+
+def test_shared_buckets_created_before_fork_limit_across_processes(tmp_path):
+    buckets = SharedTokenBuckets(str(tmp_path / 'limits'), slots=64)  # like gunicorn --preload: made in the parent
+    context = multiprocessing.get_context('fork')
+    granted = context.Queue()
+    processes = [context.Process(target=take_all, args=(buckets, granted)) for _ in range(PROCESSES)]
+    for process in processes:
+        process.start()
+    total = sum(granted.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join(60)
+    assert total == BURST